@@ -0,0 +1,61 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, OrderBy, QuerySet
+
+from api.models import Batch
+
+
+@dataclass(frozen=True)
+class AllocationStrategy:
+    """Order in which the open batches of a product are consumed by a sale
+
+    ``ordering`` leads with the product so the batches of every product in a cart
+    come from one range scan of a partial ``quantity > 0`` index on Batch, and so
+    concurrent checkouts lock the rows in the same order.
+    """
+
+    name: str
+    ordering: Tuple[OrderBy, ...]
+
+    def open_batches(self, product_ids: Iterable[int]) -> QuerySet:
+        return Batch.objects.filter(
+            product_id__in=product_ids, quantity__gt=0
+        ).order_by(*self.ordering)
+
+
+STRATEGIES: Dict[str, AllocationStrategy] = {
+    # Oldest receipt first, batch_open_fifo_idx.
+    "fifo": AllocationStrategy(
+        "fifo",
+        (F("product").asc(), F("received_at").asc(), F("id").asc()),
+    ),
+    # First expiring first, batches without obsolete_date last, batch_open_fefo_idx.
+    "fefo": AllocationStrategy(
+        "fefo",
+        (
+            F("product").asc(),
+            F("obsolete_date").asc(nulls_last=True),
+            F("received_at").asc(),
+            F("id").asc(),
+        ),
+    ),
+    # Newest receipt first, batch_open_fifo_idx scanned backwards.
+    "lifo": AllocationStrategy(
+        "lifo",
+        (F("product").desc(), F("received_at").desc(), F("id").desc()),
+    ),
+}
+
+
+def get_strategy(name: str = None) -> AllocationStrategy:
+    name = name or settings.BATCH_ALLOCATION_STRATEGY
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown batch allocation strategy {name!r}, "
+            f"expected one of {', '.join(STRATEGIES)}"
+        )
@@ -0,0 +1,247 @@
+import functools
+from datetime import date, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, ExpressionWrapper, F, Prefetch, Q, Sum
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.auth import CachedTokenAuthentication
+from api.filters import CompleteSaleFilter, ProductFilter
+from api.models import (
+    Batch,
+    CompleteSale,
+    DailySalesRollup,
+    Product,
+    SaleHistory,
+)
+from api.pagination import IdCursorPagination
+from api.reports import (
+    ReportError,
+    parse_date_range,
+    sales_report_rows,
+    valuation_params,
+    valuation_totals,
+)
+from api.serializers import CompleteSaleSerializer, ProductSerializer
+from api.stock import MONEY, inventory_valuation
+
+
+def json_response(data, status: int = 200) -> JsonResponse:
+    # Rendered like the DRF views, decimals as numbers.
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def json_bad_request(errors: dict) -> JsonResponse:
+    # Same shape as ResponseBadRequest.
+    return json_response(
+        {
+            key: [value] if isinstance(value, str) else value
+            for key, value in errors.items()
+        },
+        status=400,
+    )
+
+
+def async_api_view(view):
+    """Read-only async view authenticated with the knox token like the DRF views
+
+    The view runs on the event loop, but with Django 4.1 every ORM call still runs
+    in the sync thread of the request.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "GET":
+            return json_response(
+                {"detail": f'Método "{request.method}" no permitido.'}, status=405
+            )
+        try:
+            authenticated = await sync_to_async(
+                CachedTokenAuthentication().authenticate
+            )(request)
+            if authenticated is None:
+                raise NotAuthenticated()
+        except (AuthenticationFailed, NotAuthenticated) as e:
+            return json_response({"detail": str(e.detail)}, status=401)
+
+        request.user = authenticated[0]
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def filter_queryset(filterset_class, request, queryset):
+    filterset = filterset_class(request.GET, queryset=queryset)
+    # Validating model choices queries the database.
+    if not await sync_to_async(filterset.is_valid)():
+        raise ReportError(filterset.errors)
+    return filterset.qs
+
+
+def page_size(request) -> int:
+    try:
+        size = int(request.GET.get("page_size", IdCursorPagination.page_size))
+    except ValueError:
+        raise ReportError({"page_size": "Debe ser un número entero"})
+    return max(1, min(size, IdCursorPagination.max_page_size))
+
+
+def cursor(request, name: str):
+    try:
+        return int(request.GET[name]) if request.GET.get(name) else None
+    except ValueError:
+        raise ReportError({name: "Cursor inválido"})
+
+
+@async_api_view
+async def products(request):
+    """Products by id, ``after`` is the ``next`` of the previous page. Takes the
+    ProductFilter parameters"""
+    try:
+        queryset = await filter_queryset(
+            ProductFilter, request, Product.objects.select_related("category")
+        )
+        size, after = page_size(request), cursor(request, "after")
+    except ReportError as e:
+        return json_bad_request(e.errors)
+
+    page = queryset.order_by("id")
+    if after is not None:
+        page = page.filter(id__gt=after)
+
+    results = [product async for product in page[: size + 1].aiterator()]
+    count = await queryset.acount()
+    return json_response(
+        {
+            "count": count,
+            "next": results[size - 1].id if len(results) > size else None,
+            "results": ProductSerializer(results[:size], many=True).data,
+        }
+    )
+
+
+@async_api_view
+async def product_detail(request, pk: int):
+    try:
+        product = await Product.objects.select_related("category").aget(pk=pk)
+    except Product.DoesNotExist:
+        return json_response({"detail": "No encontrado."}, status=404)
+    return json_response(ProductSerializer(product).data)
+
+
+@async_api_view
+async def sales(request):
+    """Complete sales newest first, ``before`` is the ``next`` of the previous page.
+    Takes the CompleteSaleFilter parameters"""
+    try:
+        queryset = await filter_queryset(
+            CompleteSaleFilter, request, CompleteSale.objects.all()
+        )
+        size, before = page_size(request), cursor(request, "before")
+    except ReportError as e:
+        return json_bad_request(e.errors)
+
+    if before is not None:
+        queryset = queryset.filter(id__lt=before)
+    page = (
+        queryset.select_related("sold_by")
+        .prefetch_related(
+            Prefetch("sales", queryset=SaleHistory.objects.with_totals().order_by("id"))
+        )
+        .order_by("-id")[: size + 1]
+    )
+
+    # aiterator() cannot prefetch, async iteration fetches the page at once.
+    results = [complete_sale async for complete_sale in page]
+    return json_response(
+        {
+            "next": results[size - 1].id if len(results) > size else None,
+            "results": CompleteSaleSerializer(results[:size], many=True).data,
+        }
+    )
+
+
+@async_api_view
+async def sales_report(request):
+    """Async version of /api/reports/sales/"""
+    try:
+        rows = sales_report_rows(request.GET)
+    except ReportError as e:
+        return json_bad_request(e.errors)
+
+    return json_response([row async for row in rows])
+
+
+@async_api_view
+async def inventory_valuation_report(request):
+    """Async version of /api/reports/inventory/"""
+    try:
+        group_by, as_of = valuation_params(request.GET)
+    except ReportError as e:
+        return json_bad_request(e.errors)
+
+    rows = [row async for row in inventory_valuation(group_by, as_of)]
+    return json_response(
+        {"as_of": as_of, "totals": valuation_totals(rows), "results": rows}
+    )
+
+
+@async_api_view
+async def summary_report(request):
+    """Dashboard figures of the ``date_from``/``date_to`` range: sales from the
+    rollups, sales counts, current stock value and alert counts
+
+    The async ORM runs every query in the sync thread of the request, one after
+    the other, so they are awaited in turn rather than gathered.
+    """
+    try:
+        date_from, date_to = parse_date_range(request.GET)
+    except ReportError as e:
+        return json_bad_request(e.errors)
+
+    rollups, complete_sales = DailySalesRollup.objects.all(), CompleteSale.objects.all()
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+        complete_sales = complete_sales.filter(date_sold__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+        complete_sales = complete_sales.filter(date_sold__lte=date_to)
+
+    open_batches = Batch.objects.filter(quantity__gt=0)
+    expiry = date.today() + timedelta(days=settings.ALERT_EXPIRY_DAYS)
+    sold = await rollups.aaggregate(
+        units=Sum("units"), revenue=Sum("revenue"), cost=Sum("cost")
+    )
+    counts = await complete_sales.aaggregate(
+        sales=Count("id", filter=Q(reverted=False)),
+        reverted=Count("id", filter=Q(reverted=True)),
+    )
+    stock = await open_batches.aaggregate(
+        # Named apart from the field, a Sum can't refer to another aggregate.
+        units=Sum("quantity"),
+        value_at_cost=Sum(
+            ExpressionWrapper(F("quantity") * F("buy_price"), output_field=MONEY)
+        ),
+        value_at_sale_price=Sum(
+            ExpressionWrapper(
+                F("quantity") * F("product__sale_price"), output_field=MONEY
+            )
+        ),
+    )
+    low_stock = await Product.objects.filter(is_low_stock=True).acount()
+    expiring = await open_batches.filter(
+        obsolete_date__isnull=False, obsolete_date__lte=expiry
+    ).acount()
+    return json_response(
+        {
+            "date_from": date_from,
+            "date_to": date_to,
+            "sales": {**sold, **counts},
+            "stock": stock,
+            "low_stock_products": low_stock,
+            "expiring_batches": expiring,
+        }
+    )
@@ -0,0 +1,70 @@
+import binascii
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+
+
+def token_cache_key(digest: str) -> str:
+    return f"auth:token:{digest}"
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Knox token authentication that keeps verified tokens, with their user, in
+    the cache for ``AUTH_TOKEN_CACHE_TIMEOUT`` seconds
+
+    Entries are keyed by the token digest, never by the token itself, and never
+    outlive the token expiry. Deleting a token (logout) and saving its user
+    (deactivation, password change) drop them right away.
+    """
+
+    def authenticate_credentials(self, token: bytes):
+        try:
+            digest = hash_token(token.decode("utf-8"))
+        except (TypeError, UnicodeDecodeError, binascii.Error):
+            return super().authenticate_credentials(token)
+
+        key = token_cache_key(digest)
+        auth_token = cache.get(key)
+        if auth_token is None or (
+            auth_token.expiry is not None and auth_token.expiry < timezone.now()
+        ):
+            # Knox deletes the expired token and fails.
+            user, auth_token = super().authenticate_credentials(token)
+        elif knox_settings.AUTO_REFRESH and auth_token.expiry:
+            self.renew_token(auth_token)
+        else:
+            return self.validate_user(auth_token)
+
+        timeout = settings.AUTH_TOKEN_CACHE_TIMEOUT
+        if auth_token.expiry is not None:
+            timeout = min(timeout, (auth_token.expiry - timezone.now()).total_seconds())
+        cache.set(key, auth_token, timeout)
+        return auth_token.user, auth_token
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_token(sender, instance, **kwargs):
+    cache.delete(token_cache_key(instance.digest))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Logging in only stamps last_login.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    cache.delete_many(
+        [
+            token_cache_key(digest)
+            for digest in AuthToken.objects.filter(user=instance).values_list(
+                "digest", flat=True
+            )
+        ]
+    )
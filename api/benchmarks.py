@@ -0,0 +1,295 @@
+import asyncio
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.cache import CATEGORIES_VERSION, PRODUCTS_VERSION, reset_versions
+from api.models import CompleteSale, Product
+
+# Paginated endpoints, their query count must not depend on the page size.
+PAGED_ENDPOINTS = {
+    "products": "/api/products/",
+    "batches": "/api/batchs/",
+    "sale history": "/api/salehistory/",
+    "sales": "/api/sales/",
+}
+ENDPOINTS = {
+    **PAGED_ENDPOINTS,
+    "categories": "/api/categories/",
+    "alerts": "/api/alerts/",
+    "sales report": "/api/reports/sales/",
+    "inventory report": "/api/reports/inventory/",
+}
+
+# Read endpoints served both ways: the DRF view and its async version.
+LOAD_ENDPOINTS = {
+    "products": ("/api/products/", "/api/async/products/"),
+    "sales": ("/api/sales/", "/api/async/sales/"),
+    "sales report": ("/api/reports/sales/", "/api/async/reports/sales/"),
+    "inventory report": ("/api/reports/inventory/", "/api/async/reports/inventory/"),
+}
+
+
+@dataclass
+class Measurement:
+    name: str
+    queries: int
+    p50_ms: float
+    p99_ms: float
+    peak_memory_kib: float
+    page_size: Optional[int] = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[int((len(values) - 1) * fraction)]
+
+
+def measure(name: str, request: Callable, repeat: int, page_size: int = None):
+    """Runs ``request`` ``repeat`` times, the cached catalog responses are
+    invalidated before every run so the uncached path is measured. The query count
+    and peak memory are those of the last run."""
+    latencies = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            reset_versions([PRODUCTS_VERSION, CATEGORIES_VERSION])
+            tracemalloc.reset_peak()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: {response.status_code} {response.data}")
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(
+        name=name,
+        queries=len(queries),
+        p50_ms=round(statistics.median(latencies) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+        peak_memory_kib=round(peak / 1024, 1),
+        page_size=page_size,
+    )
+
+
+def authenticated_client(user: User = None) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user or User.objects.filter(is_superuser=True).first())
+    return client
+
+
+def measure_endpoints(
+    client: APIClient, page_size: int, repeat: int
+) -> List[Measurement]:
+    return [
+        measure(
+            name,
+            lambda url=url: client.get(url, {"page_size": page_size}),
+            repeat,
+            page_size if name in PAGED_ENDPOINTS else None,
+        )
+        for name, url in ENDPOINTS.items()
+    ]
+
+
+def query_growth(client: APIClient, small: int = 1, large: int = 50) -> Dict[str, int]:
+    """Extra queries of every paginated endpoint between two page sizes, anything
+    but 0 is an N+1"""
+    growth = {}
+    for name, url in PAGED_ENDPOINTS.items():
+        counts = [
+            measure(name, lambda: client.get(url, {"page_size": size}), 1).queries
+            for size in (small, large)
+        ]
+        growth[name] = counts[1] - counts[0]
+    return growth
+
+
+def measure_checkout(client: APIClient, lines: int, repeat: int) -> List[Measurement]:
+    """Sells carts of ``lines`` of the products with the most stock, then reverts
+    the sold carts"""
+    products = Product.objects.filter(stock__gte=repeat).order_by("-stock")[:lines]
+    cart = [{"product": product.id, "quantity": 1} for product in products]
+    if len(cart) < lines:
+        raise RuntimeError(f"Not enough products in stock for {lines} cart lines")
+
+    sell_measurement = measure(
+        f"sell ({lines} lines)",
+        lambda: client.post("/api/sales/sell/", cart, format="json"),
+        repeat,
+    )
+    sold = list(
+        CompleteSale.objects.order_by("-id").values_list("id", flat=True)[:repeat]
+    )
+    revert_measurement = measure(
+        f"revert_sale ({lines} lines)",
+        lambda: client.post(
+            "/api/sales/revert_sale/", {"sale_id": sold.pop(0)}, format="json"
+        ),
+        repeat,
+    )
+    return [sell_measurement, revert_measurement]
+
+
+@dataclass
+class LoadResult:
+    name: str
+    server: str
+    path: str
+    concurrency: int
+    requests: int
+    errors: int
+    requests_per_second: float
+    p50_ms: float
+    p99_ms: float
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+# Latency and status code of every request, and the wall time of the whole run.
+LoadRun = Tuple[List[Tuple[float, int]], float]
+
+
+def load_wsgi(path: str, token: str, requests: int, concurrency: int) -> LoadRun:
+    """Calls the WSGI application from ``concurrency`` threads, like a threaded
+    server where every request in flight holds a thread"""
+    application = get_wsgi_application()
+    factory = RequestFactory()
+
+    def call(_):
+        environ = factory.get(path, HTTP_AUTHORIZATION=f"Token {token}").environ
+        statuses = []
+        started = time.perf_counter()
+        response = application(
+            environ, lambda status, headers, exc_info=None: statuses.append(status)
+        )
+        try:
+            for _ in response:
+                pass
+        finally:
+            # Sends request_finished, which closes the thread's connection.
+            response.close()
+        return time.perf_counter() - started, int(statuses[0].split()[0])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    return results, time.perf_counter() - started
+
+
+async def load_asgi(path: str, token: str, requests: int, concurrency: int) -> LoadRun:
+    """Calls the ASGI application with ``concurrency`` requests in flight from a
+    single event loop, like uvicorn"""
+    application = get_asgi_application()
+    semaphore = asyncio.Semaphore(concurrency)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"authorization", f"Token {token}".encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+
+    async def call():
+        statuses = []
+        finished = asyncio.Event()
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        async with semaphore:
+            started = time.perf_counter()
+            await application(dict(scope), receive, send)
+            latency = time.perf_counter() - started
+        finished.set()
+        return latency, statuses[0]
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call() for _ in range(requests)))
+    return list(results), time.perf_counter() - started
+
+
+def load_result(
+    name: str, server: str, path: str, concurrency: int, run: LoadRun
+) -> LoadResult:
+    results, elapsed = run
+    latencies = [latency for latency, _ in results]
+    return LoadResult(
+        name=name,
+        server=server,
+        path=path,
+        concurrency=concurrency,
+        requests=len(results),
+        errors=sum(1 for _, status in results if status >= 400),
+        requests_per_second=round(len(results) / elapsed, 1),
+        p50_ms=round(statistics.median(latencies) * 1000, 2),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 2),
+    )
+
+
+def compare_servers(
+    token: str, requests: int, concurrency: int, endpoints: List[str]
+) -> List[LoadResult]:
+    """Throughput of every endpoint as a sync view under WSGI, the same view under
+    ASGI, and its async version under ASGI"""
+    results = []
+    for name in endpoints:
+        sync_path, async_path = LOAD_ENDPOINTS[name]
+        for server, path, run in (
+            (
+                "wsgi",
+                sync_path,
+                lambda: load_wsgi(sync_path, token, requests, concurrency),
+            ),
+            (
+                "asgi",
+                sync_path,
+                lambda: asyncio.run(load_asgi(sync_path, token, requests, concurrency)),
+            ),
+            (
+                "asgi",
+                async_path,
+                lambda: asyncio.run(
+                    load_asgi(async_path, token, requests, concurrency)
+                ),
+            ),
+        ):
+            reset_versions([PRODUCTS_VERSION, CATEGORIES_VERSION])
+            results.append(load_result(name, server, path, concurrency, run()))
+    return results
@@ -0,0 +1,120 @@
+import hashlib
+import uuid
+from typing import Iterable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.models import Category, Product
+from api.signals import catalog_changed, stock_changed
+
+PRODUCTS_VERSION = "catalog:version:products"
+CATEGORIES_VERSION = "catalog:version:categories"
+
+
+def product_version(product_id) -> str:
+    return f"catalog:version:product:{product_id}"
+
+
+def get_versions(keys: List[str]) -> List[str]:
+    """Current token of every version key, a missing one gets a fresh token so
+    responses cached before it was evicted can never be served again"""
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, token in missing.items():
+            cache.add(key, token, None)
+        versions.update(cache.get_many(missing.keys()))
+    return [versions[key] for key in keys]
+
+
+def reset_versions(keys: Iterable[str]):
+    """Invalidates every response cached under ``keys`` right away, the rest of the
+    cache is left alone"""
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def bump_versions(keys: Iterable[str]):
+    """Invalidates every response cached under ``keys`` once the transaction commits,
+    so a concurrent request cannot cache the data being replaced under the new
+    version"""
+    keys = list(keys)
+    transaction.on_commit(lambda: reset_versions(keys))
+
+
+class CachedResponseMixin:
+    """Serves ``list`` and ``retrieve`` from the cache with an ETag
+
+    Responses are cached by the tokens of the version keys of the action and the
+    request path, so they stay valid until a write bumps one of the versions and a
+    client sending back the ETag in ``If-None-Match`` gets a 304 without touching
+    the database.
+    """
+
+    list_cache_versions: List[str] = []
+
+    def get_detail_cache_versions(self) -> List[str]:
+        return self.list_cache_versions
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, self.list_cache_versions, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, self.get_detail_cache_versions(), super().retrieve, *args, **kwargs
+        )
+
+    def cached_response(self, request, version_keys, view, *args, **kwargs):
+        tag = hashlib.md5(
+            "\n".join(
+                [
+                    *get_versions(version_keys),
+                    request.accepted_renderer.format,
+                    request.get_full_path(),
+                ]
+            ).encode()
+        ).hexdigest()
+        etag = quote_etag(tag)
+
+        if etag in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        key = f"catalog:response:{tag}"
+        data = cache.get(key)
+        if data is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        else:
+            response = Response(data)
+
+        response["ETag"] = etag
+        return response
+
+
+@receiver(stock_changed)
+def invalidate_stock(sender, product_ids, **kwargs):
+    bump_versions([PRODUCTS_VERSION, *map(product_version, product_ids)])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    bump_versions([PRODUCTS_VERSION, product_version(instance.pk)])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(catalog_changed)
+def invalidate_catalog(sender, **kwargs):
+    # Product responses embed the category names.
+    bump_versions([PRODUCTS_VERSION, CATEGORIES_VERSION])
@@ -0,0 +1,158 @@
+import csv
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, List
+
+from django.db import transaction
+
+from api.models import LOW_STOCK, Category, Product
+from api.signals import catalog_changed
+
+IMPORT_CHUNK_SIZE = 2000
+
+# Accepts the product export headers (api.consts) as well as the field names.
+HEADER_ALIASES = {
+    "name": "name",
+    "nombre": "name",
+    "category": "category",
+    "categoría": "category",
+    "sale_price": "sale_price",
+    "precio unitario": "sale_price",
+    "alert_quantity": "alert_quantity",
+    "cantidad de alerta": "alert_quantity",
+}
+REQUIRED_COLUMNS = {"name", "category", "sale_price"}
+MAX_SALE_PRICE = Decimal("9999.99")
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    imported: int = 0
+    # CSV line number -> field errors, shaped like serializer errors.
+    errors: Dict[int, Dict[str, List[str]]] = field(default_factory=dict)
+
+
+def parse_row(row: Dict[str, str]):
+    """Returns ``(product_fields, errors)`` for one CSV row"""
+    errors = {}
+    name = (row.get("name") or "").strip()
+    category = (row.get("category") or "").strip()
+
+    if not name:
+        errors["name"] = ["Este campo es requerido."]
+    elif len(name) > Product._meta.get_field("name").max_length:
+        errors["name"] = ["Asegúrese de que este campo no tenga más de 254 caracteres."]
+    if not category:
+        errors["category"] = ["Este campo es requerido."]
+    elif len(category) > Category._meta.get_field("name").max_length:
+        errors["category"] = [
+            "Asegúrese de que este campo no tenga más de 255 caracteres."
+        ]
+
+    try:
+        sale_price = Decimal((row.get("sale_price") or "").strip()).quantize(
+            Decimal("0.01")
+        )
+        if not Decimal(0) <= sale_price <= MAX_SALE_PRICE:
+            raise InvalidOperation
+    except InvalidOperation:
+        errors["sale_price"] = ["Se requiere un número válido."]
+        sale_price = None
+
+    alert_quantity = (row.get("alert_quantity") or "").strip()
+    try:
+        alert_quantity = int(alert_quantity) if alert_quantity else None
+        if alert_quantity is not None and alert_quantity < 0:
+            raise ValueError
+    except ValueError:
+        errors["alert_quantity"] = ["Introduzca un número entero válido."]
+
+    return (
+        {
+            "name": name,
+            "category": category,
+            "sale_price": sale_price,
+            "alert_quantity": alert_quantity,
+        },
+        errors,
+    )
+
+
+@transaction.atomic
+def upsert_products(rows: List[dict]) -> int:
+    """Creates the missing categories and creates or updates the products by name,
+    returns the number of rows imported"""
+    imported = len(rows)
+    # Postgres refuses to upsert the same row twice in one statement. The last one
+    # wins, like a repeated name in a later chunk updates the product again.
+    rows = list({row["name"]: row for row in rows}.values())
+    category_names = {row["category"] for row in rows}
+
+    Category.objects.bulk_create(
+        [Category(name=name) for name in category_names], ignore_conflicts=True
+    )
+    category_ids = dict(
+        Category.objects.filter(name__in=category_names).values_list("name", "id")
+    )
+
+    Product.objects.bulk_create(
+        [
+            Product(
+                name=row["name"],
+                category_id=category_ids[row["category"]],
+                sale_price=row["sale_price"],
+                alert_quantity=row["alert_quantity"],
+            )
+            for row in rows
+        ],
+        update_conflicts=True,
+        unique_fields=["name"],
+        update_fields=["category_id", "sale_price", "alert_quantity"],
+    )
+    products = Product.objects.filter(name__in=[row["name"] for row in rows])
+    products.update(is_low_stock=LOW_STOCK)
+    catalog_changed.send(
+        sender=Product, product_ids=list(products.values_list("id", flat=True))
+    )
+    return imported
+
+
+def import_catalog(lines: Iterable[str]) -> ImportResult:
+    """Upserts the categories and products of a CSV catalog in bounded chunks
+
+    Rows with errors are skipped and reported, every other row is imported.
+    """
+    result = ImportResult()
+    reader = csv.DictReader(lines)
+    headers = {
+        header: HEADER_ALIASES.get(header.strip().lower())
+        for header in reader.fieldnames or []
+    }
+
+    missing = REQUIRED_COLUMNS - set(headers.values())
+    if missing:
+        result.errors[1] = {
+            column: ["Falta esta columna en el archivo."] for column in sorted(missing)
+        }
+        return result
+
+    chunk = []
+    for row in reader:
+        result.rows += 1
+        product, errors = parse_row(
+            {headers[key]: value for key, value in row.items() if headers.get(key)}
+        )
+        if errors:
+            result.errors[reader.line_num] = errors
+            continue
+
+        chunk.append(product)
+        if len(chunk) == IMPORT_CHUNK_SIZE:
+            result.imported += upsert_products(chunk)
+            chunk = []
+
+    if chunk:
+        result.imported += upsert_products(chunk)
+
+    return result
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Iterable, Optional, Set
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.auth import CachedTokenAuthentication
+from api.models import Product
+from api.signals import sales_changed, stock_changed
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = "/api/events/"
+EVENT_TYPES = {"stock", "sale"}
+
+
+class Subscriber:
+    """One connected client, lives in the event loop serving its connection"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, events: Set[str]):
+        self.loop = loop
+        self.events = events
+        self.queue: asyncio.Queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+
+    def push(self, message: bytes):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client this far behind is dropped, it reconnects and resyncs.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """In-process fan-out of server-sent events to the connections of this worker
+
+    ``publish`` may be called from any thread, every message is encoded once and
+    handed to the loop of each interested subscriber.
+    """
+
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, events: Set[str]) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop(), events)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def listening(self, event: str) -> bool:
+        with self.lock:
+            return any(event in subscriber.events for subscriber in self.subscribers)
+
+    def publish(self, event: str, data: dict):
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        with self.lock:
+            subscribers = [s for s in self.subscribers if event in s.events]
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, message)
+            except RuntimeError:
+                # The loop of the connection is already closed.
+                self.unsubscribe(subscriber)
+
+
+broker = EventBroker()
+
+
+def publish_stock(product_ids: Iterable[int]):
+    if not broker.listening("stock"):
+        return
+    broker.publish(
+        "stock",
+        {
+            "products": list(
+                Product.objects.filter(pk__in=product_ids)
+                .order_by("id")
+                .values("id", "stock", "is_low_stock")
+            )
+        },
+    )
+
+
+@receiver(stock_changed)
+def stock_event(sender, product_ids, **kwargs):
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: publish_stock(product_ids))
+
+
+@receiver(sales_changed)
+def sale_event(sender, complete_sale_ids, action, **kwargs):
+    complete_sale_ids = list(complete_sale_ids)
+    transaction.on_commit(
+        lambda: broker.publish("sale", {"action": action, "ids": complete_sale_ids})
+    )
+
+
+def authenticate(token: str) -> Optional[User]:
+    try:
+        user, _ = CachedTokenAuthentication().authenticate_credentials(token.encode())
+        return user
+    except AuthenticationFailed:
+        return None
+    finally:
+        close_old_connections()
+
+
+def get_token(scope) -> str:
+    """Knox token from the Authorization header, or from ``?token=`` since
+    browsers' EventSource cannot set headers"""
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            prefix, _, token = value.decode("latin-1").partition(" ")
+            if prefix.lower() == "token":
+                return token.strip()
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    return query.get("token", [""])[0]
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_response(send, status: int, body: bytes = b""):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def event_stream(scope, receive, send):
+    """ASGI app streaming stock and sale events as server-sent events
+
+    ``?events=stock,sale`` picks the event types, all by default. An idle
+    connection costs one coroutine waiting on its queue and a comment is sent
+    every ``EVENTS_HEARTBEAT_SECONDS`` to keep proxies from closing it.
+    """
+    if scope["method"] != "GET":
+        await send_response(send, 405)
+        return
+
+    token = get_token(scope)
+    user = await sync_to_async(authenticate)(token) if token else None
+    if user is None:
+        await send_response(send, 401, "Token inválido.".encode())
+        return
+
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    events = set(",".join(query.get("events", [])).split(",")) & EVENT_TYPES
+    subscriber = broker.subscribe(events or EVENT_TYPES)
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        }
+    )
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    message = None
+    try:
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b": connected\n\n",
+                "more_body": True,
+            }
+        )
+        while True:
+            if message is None:
+                message = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                {message, disconnected},
+                timeout=settings.EVENTS_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                return
+            if message in done:
+                body, message = message.result(), None
+                if body is None:
+                    break
+            else:
+                body = b": ping\n\n"
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    except OSError:
+        logger.debug("Event stream of %s closed", user)
+    finally:
+        broker.unsubscribe(subscriber)
+        disconnected.cancel()
+        if message is not None:
+            message.cancel()
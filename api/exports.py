@@ -0,0 +1,110 @@
+import csv
+from typing import Iterable, List
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Concat
+from django.http import StreamingHttpResponse
+
+from api.consts import (
+    BATCH_TABLE_HEADERS_WITH_PRODUCT,
+    PRODUCT_TABLE_HEADERS,
+    SALES_TABLE_HEADERS,
+)
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write returns the line, so csv.writer yields rows"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def stream_csv(
+    headers: List[str], rows: Iterable[Iterable], filename: str
+) -> StreamingHttpResponse:
+    """Streams ``rows`` as a CSV attachment without holding them in memory"""
+    writer = csv.writer(Echo())
+
+    def lines():
+        # Byte order mark so spreadsheet programs detect UTF-8.
+        yield "\ufeff" + writer.writerow(headers)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def full_name(user_field: str) -> Concat:
+    return Concat(
+        F(f"{user_field}__first_name"), Value(" "), F(f"{user_field}__last_name")
+    )
+
+
+def export_products(queryset) -> StreamingHttpResponse:
+    rows = queryset.annotate(
+        total_value=ExpressionWrapper(
+            F("stock") * F("sale_price"),
+            output_field=DecimalField(max_digits=16, decimal_places=2),
+        )
+    ).values_list(
+        "id",
+        "name",
+        "category__name",
+        "sale_price",
+        "alert_quantity",
+        "stock",
+        "total_value",
+    )
+    return stream_csv(
+        PRODUCT_TABLE_HEADERS,
+        rows.iterator(chunk_size=EXPORT_CHUNK_SIZE),
+        "productos.csv",
+    )
+
+
+def export_batches(queryset) -> StreamingHttpResponse:
+    rows = queryset.annotate(
+        bought_by_name=full_name("bought_by"),
+        total_price=ExpressionWrapper(
+            F("initial_quantity") * F("buy_price"),
+            output_field=DecimalField(max_digits=16, decimal_places=2),
+        ),
+    ).values_list(
+        "id",
+        "product__name",
+        "initial_quantity",
+        "quantity",
+        "date_created",
+        "bought_by_name",
+        "buy_price",
+        "total_price",
+    )
+    return stream_csv(
+        BATCH_TABLE_HEADERS_WITH_PRODUCT,
+        rows.iterator(chunk_size=EXPORT_CHUNK_SIZE),
+        "lotes.csv",
+    )
+
+
+def export_sales(queryset) -> StreamingHttpResponse:
+    """Exports a SaleHistory queryset annotated with ``with_totals()``"""
+    rows = queryset.annotate(
+        sold_by_name=full_name("complete_sale__sold_by"),
+    ).values_list(
+        "id",
+        "product_name",
+        "complete_sale__date_sold",
+        "sold_by_name",
+        "unit_price",
+        "quantity_sold",
+        "total_sold",
+    )
+    return stream_csv(
+        SALES_TABLE_HEADERS,
+        rows.iterator(chunk_size=EXPORT_CHUNK_SIZE),
+        "ventas.csv",
+    )
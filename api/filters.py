@@ -0,0 +1,85 @@
+from django_filters import rest_framework as filters
+
+from api.models import Batch, BatchSale, CompleteSale, Product, SaleHistory
+
+
+class ProductFilter(filters.FilterSet):
+    name = filters.CharFilter(lookup_expr="icontains")
+    low_stock = filters.BooleanFilter(field_name="is_low_stock")
+
+    class Meta:
+        model = Product
+        fields = ["category"]
+
+
+class BatchFilter(filters.FilterSet):
+    date_from = filters.DateFilter(field_name="date_created", lookup_expr="gte")
+    date_to = filters.DateFilter(field_name="date_created", lookup_expr="lte")
+    category = filters.NumberFilter(field_name="product__category")
+    is_open = filters.BooleanFilter(method="filter_is_open")
+
+    class Meta:
+        model = Batch
+        fields = ["product", "bought_by"]
+
+    def filter_is_open(self, queryset, name, value):
+        if value:
+            return queryset.filter(quantity__gt=0)
+        return queryset.filter(quantity=0)
+
+
+class CompleteSaleFilter(filters.FilterSet):
+    date_from = filters.DateFilter(field_name="date_sold", lookup_expr="gte")
+    date_to = filters.DateFilter(field_name="date_sold", lookup_expr="lte")
+    product = filters.NumberFilter(method="filter_product")
+    category = filters.NumberFilter(method="filter_category")
+
+    class Meta:
+        model = CompleteSale
+        fields = ["sold_by", "reverted"]
+
+    # Filtering through the multi-valued sales relation would duplicate rows, so
+    # products and categories are matched with a subquery instead of a join.
+    def filter_product(self, queryset, name, value):
+        return queryset.filter(
+            id__in=BatchSale.objects.filter(batch__product=value).values(
+                "sale_history__complete_sale"
+            )
+        )
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(
+            id__in=BatchSale.objects.filter(batch__product__category=value).values(
+                "sale_history__complete_sale"
+            )
+        )
+
+
+class SaleHistoryFilter(filters.FilterSet):
+    date_from = filters.DateFilter(
+        field_name="complete_sale__date_sold", lookup_expr="gte"
+    )
+    date_to = filters.DateFilter(
+        field_name="complete_sale__date_sold", lookup_expr="lte"
+    )
+    sold_by = filters.NumberFilter(field_name="complete_sale__sold_by")
+    reverted = filters.BooleanFilter(field_name="complete_sale__reverted")
+    product = filters.NumberFilter(method="filter_product")
+    category = filters.NumberFilter(method="filter_category")
+
+    class Meta:
+        model = SaleHistory
+        fields = ["complete_sale"]
+
+    # A join on batch_sales would multiply the with_totals() sums, hence subqueries.
+    def filter_product(self, queryset, name, value):
+        return queryset.filter(
+            id__in=BatchSale.objects.filter(batch__product=value).values("sale_history")
+        )
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(
+            id__in=BatchSale.objects.filter(batch__product__category=value).values(
+                "sale_history"
+            )
+        )
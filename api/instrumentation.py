@@ -0,0 +1,188 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """Prometheus histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Per series: non-cumulative bucket counts, the +Inf bucket last, and sum.
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            label_text = ",".join(
+                f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels)
+            )
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Request histograms of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        labels = ("view", "method", "status")
+        self.lock = threading.Lock()
+        self.histograms = [
+            Histogram(
+                "http_request_duration_seconds",
+                "Wall time of the request.",
+                labels,
+                DURATION_BUCKETS,
+            ),
+            Histogram(
+                "http_request_db_seconds",
+                "Time spent in the database.",
+                labels,
+                DURATION_BUCKETS,
+            ),
+            Histogram(
+                "http_request_queries",
+                "SQL queries run by the request.",
+                labels,
+                QUERY_BUCKETS,
+            ),
+        ]
+
+    def observe(self, labels: Tuple[str, ...], *values: float):
+        with self.lock:
+            for histogram, value in zip(self.histograms, values):
+                histogram.observe(labels, value)
+
+    def render(self) -> str:
+        with self.lock:
+            lines = [line for h in self.histograms for line in h.render()]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` counting queries, database time and repeated
+    SQL, parameters aside"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    def duplicates(self) -> Dict[str, int]:
+        """Fingerprint of every statement run more than once, and its count"""
+        return {
+            hashlib.md5(sql.encode()).hexdigest()[:12]: count
+            for sql, count in self.statements.most_common()
+            if count > 1
+        }
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    """Times every request and its SQL, adds them to the Server-Timing header,
+    logs them and feeds the histograms served by the metrics endpoint
+
+    Works under WSGI and ASGI. With async views both hooks run in the sync thread
+    of the request, the one the async ORM runs its queries in.
+    """
+
+    def process_request(self, request):
+        recorder = QueryRecorder()
+        connection.execute_wrappers.append(recorder)
+        request._instrumentation = (recorder, time.perf_counter())
+
+    def process_response(self, request, response):
+        recorder, started = request._instrumentation
+        connection.execute_wrappers.remove(recorder)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        metrics.observe(
+            (view, request.method, str(response.status_code)),
+            elapsed,
+            recorder.duration,
+            recorder.count,
+        )
+
+        duplicates = recorder.duplicates()
+        timings = [
+            f"app;dur={elapsed * 1000:.1f}",
+            f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"',
+        ]
+        if duplicates:
+            timings.append(f'dupq;desc="{sum(duplicates.values())} repeated"')
+        if response.has_header("Server-Timing"):
+            timings.insert(0, response["Server-Timing"])
+        response["Server-Timing"] = ", ".join(timings)
+
+        logger.log(
+            (
+                logging.WARNING
+                if elapsed >= settings.SLOW_REQUEST_SECONDS
+                else logging.INFO
+            ),
+            "%s %s %s %.1fms, %s queries in %.1fms",
+            request.method,
+            view,
+            response.status_code,
+            elapsed * 1000,
+            recorder.count,
+            recorder.duration * 1000,
+            extra={
+                "view": view,
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 2),
+                "db_ms": round(recorder.duration * 1000, 2),
+                "queries": recorder.count,
+                "duplicate_queries": duplicates,
+            },
+        )
+        return response
@@ -0,0 +1,70 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmarks import (
+    authenticated_client,
+    measure_checkout,
+    measure_endpoints,
+    query_growth,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures query count, p50/p99 latency and peak memory of every API "
+        "endpoint and of sell/revert_sale, and fails when a paginated endpoint "
+        "runs more queries for bigger pages. Use --seed for a realistic volume "
+        "(seed_data defaults: 5k products, 200k batches, ~1M batch sales)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed", action="store_true", help="Run seed_data with its defaults first"
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--lines", type=int, default=10, help="Cart lines")
+        parser.add_argument("-o", "--output", help="JSON file to write results to")
+
+    def handle(self, *args, seed, repeat, page_size, lines, output, **options):
+        if seed:
+            call_command("seed_data", stdout=self.stdout)
+
+        client = authenticated_client()
+        growth = query_growth(client, large=page_size)
+        measurements = measure_endpoints(client, page_size, repeat)
+        measurements += measure_checkout(client, lines, repeat)
+
+        for m in measurements:
+            self.stdout.write(
+                f"{m.name:<24} {m.queries:>4} queries  p50 {m.p50_ms:>8.1f}ms  "
+                f"p99 {m.p99_ms:>8.1f}ms  peak {m.peak_memory_kib:>9.1f}KiB"
+            )
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(
+                    {
+                        "date": datetime.now(timezone.utc).isoformat(),
+                        "database": connection.vendor,
+                        "python": platform.python_version(),
+                        "repeat": repeat,
+                        "query_growth": growth,
+                        "results": [m.as_dict() for m in measurements],
+                    },
+                    f,
+                    indent=2,
+                )
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        grown = {name: extra for name, extra in growth.items() if extra}
+        if grown:
+            raise CommandError(
+                "Query count grows with the page size: "
+                + ", ".join(f"{name} +{extra}" for name, extra in grown.items())
+            )
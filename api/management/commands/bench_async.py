@@ -0,0 +1,67 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from knox.models import AuthToken
+
+from api.benchmarks import LOAD_ENDPOINTS, compare_servers
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test comparing the read endpoints as sync views under WSGI, as sync "
+        "views under ASGI and as async views under ASGI, with many requests in "
+        "flight. The applications are called in-process, no server is needed. "
+        "Uses a temporary token of the first superuser."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument(
+            "--endpoint",
+            action="append",
+            choices=list(LOAD_ENDPOINTS),
+            help="Endpoint to load, all by default. Can be repeated.",
+        )
+        parser.add_argument("-o", "--output", help="JSON file to write results to")
+
+    def handle(self, *args, requests, concurrency, endpoint, output, **options):
+        user = User.objects.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError("A superuser is needed, run seed_data first")
+
+        auth_token, token = AuthToken.objects.create(user)
+        try:
+            results = compare_servers(
+                token, requests, concurrency, endpoint or list(LOAD_ENDPOINTS)
+            )
+        finally:
+            auth_token.delete()
+
+        for r in results:
+            self.stdout.write(
+                f"{r.name:<18} {r.server} {r.path:<32} {r.requests_per_second:>8.1f} "
+                f"req/s  p50 {r.p50_ms:>8.1f}ms  p99 {r.p99_ms:>8.1f}ms  "
+                f"{r.errors} errors"
+            )
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(
+                    {
+                        "date": datetime.now(timezone.utc).isoformat(),
+                        "database": connection.vendor,
+                        "python": platform.python_version(),
+                        "results": [r.as_dict() for r in results],
+                    },
+                    f,
+                    indent=2,
+                )
+            self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if any(r.errors for r in results):
+            raise CommandError("Some requests failed")
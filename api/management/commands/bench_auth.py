@@ -0,0 +1,61 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from knox.auth import TokenAuthentication
+from knox.models import AuthToken
+from rest_framework.request import Request
+
+from api.auth import CachedTokenAuthentication, token_cache_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the per-request cost of knox token authentication with and "
+        "without the verified-token cache. Creates its own user and removes it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument(
+            "--tokens", type=int, default=5, help="Other tokens of the same user"
+        )
+
+    def handle(self, *args, requests, tokens, **options):
+        user = User.objects.create_user(f"bench-{uuid.uuid4().hex[:8]}")
+        for _ in range(tokens):
+            AuthToken.objects.create(user)
+        auth_token, token = AuthToken.objects.create(user)
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Token {token}")
+
+        try:
+            # Only this token's entry, the cache may be shared with other processes.
+            cache.delete(token_cache_key(auth_token.digest))
+            for name, authentication in (
+                ("knox", TokenAuthentication()),
+                ("cached", CachedTokenAuthentication()),
+            ):
+                self.run(name, authentication, request, requests)
+        finally:
+            user.delete()
+
+    def run(self, name, authentication, request, requests):
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(requests):
+                started = time.perf_counter()
+                authentication.authenticate(Request(request))
+                latencies.append(time.perf_counter() - started)
+
+        latencies.sort()
+        self.stdout.write(
+            f"{name}: p50 {statistics.median(latencies) * 1e6:.0f}us, "
+            f"p99 {latencies[int((len(latencies) - 1) * 0.99)] * 1e6:.0f}us, "
+            f"{len(queries) / requests:.2f} queries per request"
+        )
@@ -0,0 +1,133 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from api.models import (
+    Batch,
+    BatchSale,
+    Category,
+    CompleteSale,
+    DailySalesRollup,
+    Product,
+)
+from api.sales import SaleError, sell_cart
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the lock and optimistic checkout modes by selling one hot product "
+        "from many concurrent threads. Creates its own products and removes them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--sales", type=int, default=50, help="Sales per thread")
+        parser.add_argument("--batches", type=int, default=20)
+        parser.add_argument(
+            "--modes", nargs="+", default=["lock", "optimistic"], metavar="MODE"
+        )
+
+    def handle(self, *args, threads, sales, batches, modes, **options):
+        if connection.vendor == "sqlite":
+            self.stderr.write("SQLite serializes writers, results are not meaningful")
+
+        user = User.objects.filter(is_superuser=True).first()
+        for mode in modes:
+            with override_settings(CHECKOUT_STOCK_MODE=mode):
+                self.run_mode(mode, user, threads, sales, batches)
+
+    def run_mode(self, mode, user, threads, sales, batches):
+        category = Category.objects.create(name=f"bench-{uuid.uuid4().hex[:8]}")
+        product = Product.objects.create(
+            name=category.name, category=category, sale_price=1, alert_quantity=0
+        )
+        total_units = threads * sales
+        units_per_batch = -(-total_units // batches)
+        Batch.objects.bulk_create(
+            [
+                Batch(
+                    product=product,
+                    quantity=units_per_batch,
+                    initial_quantity=units_per_batch,
+                    buy_price=1,
+                    bought_by=user,
+                )
+                for _ in range(batches)
+            ]
+        )
+        product.stock = units_per_batch * batches
+        product.save(update_fields=["stock"])
+        stock = product.stock
+
+        latencies = []
+        rejected = []
+        retries = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(sales):
+                    started = time.perf_counter()
+                    try:
+                        checkout = sell_cart(
+                            [{"product": product.id, "quantity": 1}], user
+                        )
+                    except SaleError:
+                        with lock:
+                            rejected.append(1)
+                        continue
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        retries.append(checkout.attempts - 1)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        sold = (
+            BatchSale.objects.filter(batch__product=product).aggregate(Sum("quantity"))[
+                "quantity__sum"
+            ]
+            or 0
+        )
+        remaining = Batch.objects.filter(product=product).aggregate(Sum("quantity"))[
+            "quantity__sum"
+        ]
+        latencies.sort()
+
+        self.stdout.write(
+            f"{mode}: {len(latencies)} sales in {elapsed:.2f}s "
+            f"({len(latencies) / elapsed:.1f}/s), "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {latencies[int((len(latencies) - 1) * 0.99)] * 1000:.1f}ms, "
+            f"retries {sum(retries)}, rejected {len(rejected)}"
+        )
+        product.refresh_from_db()
+        if sold + remaining != stock or product.stock != remaining:
+            self.stderr.write(
+                self.style.ERROR(f"{mode}: stock mismatch, {sold} + {remaining}")
+            )
+
+        with transaction.atomic():
+            # Rollups protect the product they count.
+            DailySalesRollup.objects.filter(product=product).delete()
+            CompleteSale.objects.filter(
+                sales__batch_sales__batch__product=product
+            ).delete()
+            Batch.objects.filter(product=product).delete()
+            product.delete()
+            category.delete()
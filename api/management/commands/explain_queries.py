@@ -0,0 +1,114 @@
+from datetime import date, timedelta
+from typing import List
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.allocation import STRATEGIES
+from api.models import Batch, CompleteSale, Product, SaleHistory
+
+
+class RestoreIndexes(Exception):
+    def __init__(self, lines: List[str]):
+        super().__init__()
+        self.lines = lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Captures EXPLAIN ANALYZE of the hot sales and batch queries. Seed a large "
+        "dataset with seed_data, then compare the plans without and with the indexes:\n"
+        "  manage.py explain_queries --without-indexes -o before.txt\n"
+        "  manage.py explain_queries -o after.txt\n"
+        "--without-indexes drops the indexes of the api models in a transaction that "
+        "is rolled back, it locks the tables meanwhile so never use it in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("-o", "--output", help="File to write the plans to")
+        parser.add_argument(
+            "--without-indexes",
+            action="store_true",
+            help="Explain as if the Meta.indexes of the api models did not exist",
+        )
+
+    def queries(self):
+        product = (
+            Product.objects.filter(batch__quantity__gt=0)
+            .order_by("-stock")
+            .values_list("id", "category_id")
+            .first()
+        )
+        if product is None:
+            raise CommandError("There are no open batches, run seed_data first")
+        product_id, category_id = product
+        seller_id = CompleteSale.objects.values_list("sold_by", flat=True).first()
+        last_month = date.today() - timedelta(days=30)
+
+        return {
+            **{
+                f"open batches of a product ({name})": strategy.open_batches(
+                    [product_id]
+                )
+                for name, strategy in STRATEGIES.items()
+            },
+            "batches received last month": Batch.objects.filter(
+                date_created__gte=last_month
+            ).order_by("-id")[:50],
+            "catalog page": Product.objects.select_related("category").order_by("name")[
+                :50
+            ],
+            "catalog page of a category": Product.objects.filter(
+                category=category_id
+            ).order_by("name")[:50],
+            "latest sales": CompleteSale.objects.order_by("-id")[:50],
+            "sales of last month": CompleteSale.objects.filter(
+                date_sold__gte=last_month
+            ).order_by("-id")[:50],
+            "sales of a seller": CompleteSale.objects.filter(
+                sold_by=seller_id
+            ).order_by("-id")[:50],
+            "sale history page": SaleHistory.objects.with_totals().order_by("-id")[:50],
+        }
+
+    def explain(self, analyze: bool) -> List[str]:
+        lines = []
+        for name, queryset in self.queries().items():
+            lines.append(f"-- {name}")
+            lines.append(str(queryset.query))
+            lines.append(
+                queryset.explain(analyze=analyze) if analyze else queryset.explain()
+            )
+            lines.append("")
+        return lines
+
+    def explain_without_indexes(self, analyze: bool) -> List[str]:
+        # DDL is transactional on PostgreSQL and SQLite, leaving the schema editor's
+        # transaction with an exception restores the indexes.
+        try:
+            with connection.schema_editor(atomic=True) as schema_editor:
+                for model in apps.get_app_config("api").get_models():
+                    for index in model._meta.indexes:
+                        schema_editor.remove_index(model, index)
+                raise RestoreIndexes(self.explain(analyze))
+        except RestoreIndexes as restore:
+            return restore.lines
+
+    def handle(self, *args, output=None, without_indexes=False, **options):
+        analyze = connection.vendor == "postgresql"
+        if not analyze:
+            self.stderr.write("EXPLAIN ANALYZE needs PostgreSQL, showing plans only")
+
+        if without_indexes:
+            lines = self.explain_without_indexes(analyze)
+        else:
+            lines = self.explain(analyze)
+
+        text = "\n".join(lines)
+        if output:
+            with open(output, "w") as f:
+                f.write(text)
+            self.stdout.write(self.style.SUCCESS(f"Plans written to {output}"))
+        else:
+            self.stdout.write(text)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.catalog import import_catalog
+
+
+class Command(BaseCommand):
+    help = "Upserts categories and products by name from a CSV catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            help="CSV with name, category, sale_price and alert_quantity columns",
+        )
+
+    def handle(self, *args, path, **options):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            result = import_catalog(f)
+
+        for line, errors in result.errors.items():
+            for field, messages in errors.items():
+                self.stderr.write(f"line {line}, {field}: {' '.join(messages)}")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{result.imported} of {result.rows} rows imported, "
+                f"{len(result.errors)} with errors"
+            )
+        )
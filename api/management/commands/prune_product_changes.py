@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from api.models import ProductChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes delta-sync log entries older than --days, terminals whose token is "
+        "older than the remaining log get the whole catalog on their next sync. The "
+        "newest entry is always kept so the log still tells how far it reached"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30)
+
+    def handle(self, *args, days, **options):
+        newest = ProductChange.objects.aggregate(newest=Max("id"))["newest"]
+        deleted, _ = (
+            ProductChange.objects.filter(
+                changed_at__lt=timezone.now() - timedelta(days=days)
+            )
+            .exclude(id=newest)
+            .delete()
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} product changes"))
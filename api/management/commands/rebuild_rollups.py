@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily sales rollups from the batch sales"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", type=date.fromisoformat)
+        parser.add_argument("--date-to", type=date.fromisoformat)
+
+    def handle(self, *args, date_from=None, date_to=None, **options):
+        created = rebuild_rollups(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} rollup rows"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from api.models import Product
+from api.stock import batch_stock_subquery, sync_product_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies Product.stock against the batches and rebuilds the mismatching rows"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report mismatches, exit with an error if any is found",
+        )
+
+    def handle(self, *args, check=False, **options):
+        with transaction.atomic():
+            mismatches = list(
+                Product.objects.select_for_update()
+                .annotate(batch_stock=batch_stock_subquery())
+                .exclude(stock=F("batch_stock"))
+                .values_list("id", "name", "stock", "batch_stock")
+            )
+
+            for product_id, name, stock, batch_stock in mismatches:
+                self.stdout.write(
+                    f"{product_id} {name}: stock={stock} batches={batch_stock}"
+                )
+
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS("Stock is consistent"))
+                return
+
+            if check:
+                raise CommandError(
+                    f"{len(mismatches)} products have inconsistent stock"
+                )
+
+            sync_product_stock(product_id for product_id, *_ in mismatches)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt stock of {len(mismatches)} products")
+        )
@@ -0,0 +1,163 @@
+import random
+import uuid
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Batch, BatchSale, Category, CompleteSale, Product, SaleHistory
+from api.rollups import rebuild_rollups
+from api.stock import sync_product_stock
+
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a large synthetic catalog, batches and sales history for "
+        "benchmarks and query plans. Never run it against production data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--batches", type=int, default=200_000)
+        parser.add_argument("--sales", type=int, default=300_000)
+        parser.add_argument("--lines", type=int, default=3, help="Lines per sale")
+        parser.add_argument("--days", type=int, default=730, help="History length")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.today = date.today()
+        self.days = options["days"]
+        self.user = User.objects.filter(is_superuser=True).first()
+        if self.user is None:
+            self.user = User.objects.create_superuser("seed", "seed@example.com")
+
+        with transaction.atomic():
+            products = self.create_products(options["categories"], options["products"])
+            batches = self.create_batches(products, options["batches"])
+            self.create_sales(batches, options["sales"], options["lines"])
+            sync_product_stock(product.id for product in products)
+            # Sales are bulk created, the reports read the rollups.
+            self.stdout.write(f"{rebuild_rollups()} rollup rows")
+
+    def random_date(self) -> date:
+        return self.today - timedelta(days=self.random.randrange(self.days))
+
+    def create_products(self, categories: int, products: int):
+        # Names are unique, runs with the same --seed must not collide.
+        prefix = f"seed-{uuid.uuid4().hex[:8]}"
+        category_instances = Category.objects.bulk_create(
+            [Category(name=f"{prefix} categoría {i}") for i in range(categories)]
+        )
+        product_instances = Product.objects.bulk_create(
+            [
+                Product(
+                    name=f"{prefix} producto {i}",
+                    category=self.random.choice(category_instances),
+                    sale_price=Decimal(self.random.randrange(100, 50000)) / 100,
+                    alert_quantity=self.random.randrange(0, 100),
+                )
+                for i in range(products)
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+        self.stdout.write(f"{categories} categories, {products} products")
+        return product_instances
+
+    def create_batches(self, products, batches: int):
+        batch_instances = []
+        for _ in range(batches):
+            product = self.random.choice(products)
+            quantity = self.random.randrange(20, 500)
+            batch_instances.append(
+                Batch(
+                    product=product,
+                    quantity=quantity,
+                    initial_quantity=quantity,
+                    buy_price=(product.sale_price * Decimal("0.6")).quantize(
+                        Decimal("0.01")
+                    ),
+                    bought_by=self.user,
+                    obsolete_date=self.today
+                    + timedelta(days=self.random.randrange(-30, 720)),
+                )
+            )
+        Batch.objects.bulk_create(batch_instances, batch_size=CHUNK_SIZE)
+
+        # Receipt dates are auto_now_add, so bulk_create stamps now on every row.
+        for batch in batch_instances:
+            batch.date_created = self.random_date()
+            batch.received_at = datetime.combine(
+                batch.date_created,
+                time(self.random.randrange(8, 18), self.random.randrange(60)),
+                tzinfo=timezone.utc,
+            )
+        Batch.objects.bulk_update(
+            batch_instances, ["date_created", "received_at"], batch_size=CHUNK_SIZE
+        )
+        self.stdout.write(f"{batches} batches")
+
+        batches_by_product = {}
+        for batch in sorted(batch_instances, key=lambda b: (b.received_at, b.id)):
+            batches_by_product.setdefault(batch.product_id, []).append(batch)
+        return batches_by_product
+
+    def create_sales(self, batches_by_product, sales: int, lines: int):
+        product_ids = list(batches_by_product)
+        batch_sales_count = 0
+
+        for start in range(0, sales, CHUNK_SIZE):
+            complete_sales = CompleteSale.objects.bulk_create(
+                [
+                    CompleteSale(sold_by=self.user)
+                    for _ in range(min(CHUNK_SIZE, sales - start))
+                ]
+            )
+            for complete_sale in complete_sales:
+                complete_sale.date_sold = self.random_date()
+            CompleteSale.objects.bulk_update(complete_sales, ["date_sold"])
+
+            sale_histories = []
+            allocations = []
+            for complete_sale in complete_sales:
+                for product_id in self.random.sample(product_ids, lines):
+                    open_batches = [
+                        b for b in batches_by_product[product_id] if b.quantity
+                    ][:3]
+                    if not open_batches:
+                        continue
+                    sale_history = SaleHistory(
+                        unit_price=float(open_batches[0].product.sale_price),
+                        complete_sale=complete_sale,
+                    )
+                    sale_histories.append(sale_history)
+
+                    remaining = self.random.randrange(1, 10)
+                    for batch in open_batches:
+                        quantity = min(remaining, batch.quantity)
+                        batch.quantity -= quantity
+                        remaining -= quantity
+                        allocations.append((sale_history, batch, quantity))
+                        if not remaining:
+                            break
+
+            SaleHistory.objects.bulk_create(sale_histories)
+            BatchSale.objects.bulk_create(
+                [
+                    BatchSale(sale_history=sale_history, batch=batch, quantity=quantity)
+                    for sale_history, batch, quantity in allocations
+                ]
+            )
+            batch_sales_count += len(allocations)
+
+        Batch.objects.bulk_update(
+            [batch for batches in batches_by_product.values() for batch in batches],
+            ["quantity"],
+            batch_size=CHUNK_SIZE,
+        )
+        self.stdout.write(f"{sales} sales, {batch_sales_count} batch sales")
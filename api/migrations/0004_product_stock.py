@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:35
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_stock(apps, schema_editor):
+    Batch = apps.get_model("api", "Batch")
+    Product = apps.get_model("api", "Product")
+    Product.objects.update(
+        stock=Coalesce(
+            Subquery(
+                Batch.objects.filter(product=OuterRef("pk"))
+                .order_by()
+                .values("product")
+                .annotate(total=Sum("quantity"))
+                .values("total")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_alter_batchsale_sale_history"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="stock",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_product_stock"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="category",
+            name="name",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="batch",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["product", "-date_created", "id"],
+                name="batch_open_allocation_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="batch",
+            index=models.Index(
+                fields=["date_created", "id"], name="batch_date_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="completesale",
+            index=models.Index(fields=["date_sold", "id"], name="sale_date_sold_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="completesale",
+            index=models.Index(fields=["sold_by", "-id"], name="sale_sold_by_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "name"], name="product_category_name_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:02
+
+import datetime
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_date_created(apps, schema_editor):
+    """Existing batches are considered received at midnight of their date_created"""
+    Batch = apps.get_model("api", "Batch")
+    batches = list(Batch.objects.only("id", "date_created"))
+    for batch in batches:
+        batch.received_at = datetime.datetime.combine(
+            batch.date_created, datetime.time.min, tzinfo=datetime.timezone.utc
+        )
+    Batch.objects.bulk_update(batches, ["received_at"], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_sales_and_batch_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="batch",
+            name="date_created",
+            field=models.DateField(auto_now_add=True),
+        ),
+        migrations.AddField(
+            model_name="batch",
+            name="received_at",
+            field=models.DateTimeField(
+                auto_now_add=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_date_created, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name="batch",
+            name="batch_open_allocation_idx",
+        ),
+        migrations.AddIndex(
+            model_name="batch",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["product", "received_at", "id"],
+                name="batch_open_fifo_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="batch",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["product", "obsolete_date", "received_at", "id"],
+                name="batch_open_fefo_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+
+def populate_is_low_stock(apps, schema_editor):
+    Product = apps.get_model("api", "Product")
+    Product.objects.update(
+        is_low_stock=Case(
+            When(stock__lt=F("alert_quantity"), then=Value(True)),
+            default=Value(False),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_daily_sales_rollup"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="is_low_stock",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(populate_is_low_stock, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="batch",
+            index=models.Index(
+                condition=models.Q(
+                    ("obsolete_date__isnull", False), ("quantity__gt", 0)
+                ),
+                fields=["obsolete_date"],
+                name="batch_open_expiry_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                condition=models.Q(("is_low_stock", True)),
+                fields=["category", "name"],
+                name="product_low_stock_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:51
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    """Moves everything pointing at a duplicated category name to its oldest row"""
+    Category = apps.get_model("api", "Category")
+    Product = apps.get_model("api", "Product")
+    DailySalesRollup = apps.get_model("api", "DailySalesRollup")
+
+    duplicates = (
+        Category.objects.values("name")
+        .annotate(count=Count("id"), keep=Min("id"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        others = Category.objects.filter(name=duplicate["name"]).exclude(
+            pk=duplicate["keep"]
+        )
+        Product.objects.filter(category__in=others).update(category=duplicate["keep"])
+        DailySalesRollup.objects.filter(category__in=others).update(
+            category=duplicate["keep"]
+        )
+        others.delete()
+
+
+class Migration(migrations.Migration):
+    # Separate from the unique constraint, PostgreSQL can't ALTER a table with
+    # pending trigger events left by the updates in the same transaction.
+
+    dependencies = [
+        ("api", "0008_stock_alerts"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Renumbered, databases that applied the old name keep it applied.
+    replaces = [("api", "0009_unique_category_name")]
+
+    dependencies = [
+        ("api", "0009_merge_duplicate_categories"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="category",
+            name="name",
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
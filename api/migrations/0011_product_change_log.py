@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Renumbered, databases that applied the old name keep it applied.
+    replaces = [("api", "0010_product_change_log")]
+
+    dependencies = [
+        ("api", "0010_unique_category_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("product_id", models.BigIntegerField()),
+                ("changed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["changed_at"], name="product_change_at_idx")
+                ],
+            },
+        ),
+    ]
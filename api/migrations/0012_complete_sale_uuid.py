@@ -0,0 +1,20 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Renumbered, databases that applied the old name keep it applied.
+    replaces = [("api", "0011_complete_sale_uuid")]
+
+    dependencies = [
+        ("api", "0011_product_change_log"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="completesale",
+            name="uuid",
+            field=models.UUIDField(null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Renumbered, databases that applied the old name keep it applied.
+    replaces = [("api", "0012_complete_sale_reverted_on")]
+
+    dependencies = [
+        ("api", "0012_complete_sale_uuid"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="completesale",
+            name="reverted_on",
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_complete_sale_reverted_on"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BatchSaleReturn",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveIntegerField()),
+                ("returned_on", models.DateField(auto_now_add=True)),
+                (
+                    "batch_sale",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="returns",
+                        to="api.batchsale",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -1,13 +1,44 @@
 from datetime import date
-from functools import lru_cache
+from typing import Tuple
 
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models import Sum
+from django.db.models import ExpressionWrapper, F, FloatField, Max, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils.functional import cached_property
+
+
+class ComputedFieldsMixin:
+    """Per-instance cache for derived values declared with ``cached_property``
+
+    Values are stored in the instance ``__dict__``, so a queryset annotation with the
+    same name prefills them, and they die with the instance. They are dropped when
+    the instance is saved or refreshed, or explicitly with ``invalidate_computed``.
+    """
+
+    computed_fields: Tuple[str, ...] = ()
+
+    def invalidate_computed(self):
+        for name in self.computed_fields:
+            self.__dict__.pop(name, None)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.invalidate_computed()
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.invalidate_computed()
 
 
 class Category(models.Model):
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
+
+
+LOW_STOCK = models.Case(
+    models.When(stock__lt=F("alert_quantity"), then=Value(True)),
+    default=Value(False),
+)
 
 
 class Product(models.Model):
@@ -15,6 +46,34 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     sale_price = models.DecimalField(max_digits=6, decimal_places=2)
     alert_quantity = models.PositiveBigIntegerField(null=True)
+    # Denormalized sum of ``Batch.quantity``, maintained by ``api.stock``.
+    stock = models.PositiveIntegerField(default=0)
+    # stock < alert_quantity, maintained by ``save`` and ``api.stock``.
+    is_low_stock = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            # Catalog page of one category, filtered by category and ordered by name.
+            models.Index(fields=["category", "name"], name="product_category_name_idx"),
+            # Low stock watchlist.
+            models.Index(
+                fields=["category", "name"],
+                condition=models.Q(is_low_stock=True),
+                name="product_low_stock_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Stock only moves through api.stock, never write back a stale copy.
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ("stock", "is_low_stock")
+            ]
+        super().save(*args, **kwargs)
+        Product.objects.filter(pk=self.pk).update(is_low_stock=LOW_STOCK)
+        self.refresh_from_db(fields=["stock", "is_low_stock"])
 
     @property
     def total_value(self) -> float:
@@ -22,17 +81,11 @@ class Product(models.Model):
 
     @property
     def quantity(self) -> int:
-        quantity = self.batch_set.filter(product__name=self.name).aggregate(
-            Sum("quantity")
-        )["quantity__sum"]
-
-        return quantity if quantity else 0
+        return self.stock
 
     @property
     def is_inventory_low(self) -> bool:
-        quantity = self.quantity
-
-        return quantity < self.alert_quantity
+        return self.is_low_stock
 
 
 class Batch(models.Model):
@@ -41,7 +94,9 @@ class Batch(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     buy_price = models.DecimalField(max_digits=6, decimal_places=2)
     bought_by = models.ForeignKey(User, on_delete=models.PROTECT)
-    date_created = models.DateField(auto_now=True)
+    date_created = models.DateField(auto_now_add=True)
+    # Immutable receipt instant, orders the batches of a product for allocation.
+    received_at = models.DateTimeField(auto_now_add=True)
     obsolete_date = models.DateField(null=True)
 
     @property
@@ -50,22 +105,53 @@ class Batch(models.Model):
 
     class Meta:
         ordering = ("-date_created", "id")
+        indexes = [
+            # Open batches of a product for the allocation strategies in
+            # ``api.allocation``, LIFO scans the FIFO index backwards.
+            models.Index(
+                fields=["product", "received_at", "id"],
+                condition=models.Q(quantity__gt=0),
+                name="batch_open_fifo_idx",
+            ),
+            models.Index(
+                fields=["product", "obsolete_date", "received_at", "id"],
+                condition=models.Q(quantity__gt=0),
+                name="batch_open_fefo_idx",
+            ),
+            models.Index(fields=["date_created", "id"], name="batch_date_created_idx"),
+            # Expiring batches watchlist, only batches with stock left matter.
+            models.Index(
+                fields=["obsolete_date"],
+                condition=models.Q(quantity__gt=0, obsolete_date__isnull=False),
+                name="batch_open_expiry_idx",
+            ),
+        ]
 
     @property
     def days_until_obsolete(self):
         if not self.obsolete_date:
             return
-        return (date.today() - self.obsolete_date).days
+        return (self.obsolete_date - date.today()).days
 
     @property
     def is_obsolete(self) -> bool:
-        return self.obsolete_date and date.today() < self.obsolete_date
+        return bool(self.obsolete_date) and self.obsolete_date <= date.today()
 
 
 class CompleteSale(models.Model):
-    date_sold = models.DateField(auto_now=True)
+    date_sold = models.DateField(auto_now_add=True)
     reverted = models.BooleanField(default=False)
+    # Day the sale was reverted, the stock history of api.stock reads it.
+    reverted_on = models.DateField(null=True, blank=True)
     sold_by = models.ForeignKey(User, on_delete=models.PROTECT)
+    # Generated by the terminal, resubmitting a sale with it never sells twice.
+    uuid = models.UUIDField(null=True, unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date_sold", "id"], name="sale_date_sold_idx"),
+            models.Index(fields=["sold_by", "-id"], name="sale_sold_by_idx"),
+        ]
 
     # @property
     # def quantity_sold(self) -> float:
@@ -80,38 +166,143 @@ class CompleteSale(models.Model):
     #     ]
 
 
-class SaleHistory(models.Model):
+class SaleHistoryQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Prefills the computed fields of every row with values computed in SQL
+
+        Every batch sale of a sale history belongs to the same product, so the
+        names can be aggregated with Max in the same GROUP BY as the sums.
+        """
+        return self.annotate(
+            quantity_sold=Coalesce(Sum("batch_sales__quantity"), 0),
+            total_cost=Coalesce(
+                Cast(
+                    Sum(
+                        F("batch_sales__quantity") * F("batch_sales__batch__buy_price")
+                    ),
+                    FloatField(),
+                ),
+                Value(0.0),
+            ),
+            product_name=Max("batch_sales__batch__product__name"),
+            category_name=Max("batch_sales__batch__product__category__name"),
+        ).annotate(
+            total_sold=ExpressionWrapper(
+                F("quantity_sold") * F("unit_price"), output_field=FloatField()
+            ),
+            total_renevue=ExpressionWrapper(
+                F("total_sold") - F("total_cost"), output_field=FloatField()
+            ),
+        )
+
+
+class SaleHistory(ComputedFieldsMixin, models.Model):
     unit_price = models.FloatField()
     complete_sale = models.ForeignKey(
         CompleteSale, on_delete=models.CASCADE, null=True, related_name="sales"
     )
 
-    @property
-    @lru_cache(maxsize=10)
+    objects = SaleHistoryQuerySet.as_manager()
+
+    computed_fields = (
+        "quantity_sold",
+        "total_sold",
+        "total_cost",
+        "total_renevue",
+        "product_name",
+        "category_name",
+    )
+
+    @cached_property
     def quantity_sold(self) -> int:
-        return self.batch_sales.all().aggregate(Sum("quantity"))["quantity__sum"]
+        return sum(bs.quantity for bs in self.batch_sales.all())
 
-    @property
+    @cached_property
     def total_sold(self) -> float:
         return self.quantity_sold * self.unit_price
 
-    @property
+    @cached_property
     def total_cost(self) -> float:
         return sum([float(bs.total_cost) for bs in self.batch_sales.all()])
 
-    @property
+    @cached_property
     def total_renevue(self) -> float:
         return self.total_sold - self.total_cost
 
+    @cached_property
+    def product_name(self) -> str:
+        return (
+            self.batch_sales.select_related("batch__product").first().batch.product.name
+        )
+
+    @cached_property
+    def category_name(self) -> str:
+        return (
+            self.batch_sales.select_related("batch__product__category")
+            .first()
+            .batch.product.category.name
+        )
+
 
-class BatchSale(models.Model):
+class BatchSale(ComputedFieldsMixin, models.Model):
     quantity = models.PositiveIntegerField()
     batch = models.ForeignKey(Batch, on_delete=models.PROTECT)
     sale_history = models.ForeignKey(
         SaleHistory, on_delete=models.CASCADE, related_name="batch_sales"
     )
 
-    @property
-    @lru_cache(maxsize=10)
+    computed_fields = ("total_cost",)
+
+    @cached_property
     def total_cost(self) -> int:
         return self.batch.buy_price * self.quantity
+
+
+class BatchSaleReturn(models.Model):
+    """Units of a batch sale given back by a partial revert, ``BatchSale.quantity``
+    keeps what is still sold"""
+
+    batch_sale = models.ForeignKey(
+        BatchSale, on_delete=models.CASCADE, related_name="returns"
+    )
+    quantity = models.PositiveIntegerField()
+    returned_on = models.DateField(auto_now_add=True)
+
+
+class DailySalesRollup(models.Model):
+    """Sales totals per day, product and seller, maintained by ``api.rollups``"""
+
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    seller = models.ForeignKey(User, on_delete=models.PROTECT)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product", "seller"], name="rollup_day_product_seller"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["date", "category"], name="rollup_date_category_idx"),
+            models.Index(fields=["seller", "date"], name="rollup_seller_date_idx"),
+        ]
+
+    @property
+    def margin(self) -> float:
+        return self.revenue - self.cost
+
+
+class ProductChange(models.Model):
+    """Append-only log of changed products, its ids are the delta-sync tokens of
+    ``api.sync``"""
+
+    # No foreign key, deleted products stay in the log so terminals drop them.
+    product_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["changed_at"], name="product_change_at_idx")]
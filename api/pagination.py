@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key, newest first"""
+
+    ordering = "-id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class ProductCursorPagination(IdCursorPagination):
+    # DRF only keys the cursor on the first field and falls back to an OFFSET among
+    # equal values, product names are unique so every page is a plain keyset seek.
+    ordering = "name"
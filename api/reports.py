@@ -0,0 +1,97 @@
+from datetime import date
+from typing import List, Optional, Tuple
+
+from django.db.models import F, QuerySet, Sum
+from django.db.models.functions import TruncMonth, TruncYear
+
+from api.models import DailySalesRollup
+from api.stock import VALUATION_GROUPS
+
+# Column and name annotation of every report grouping.
+REPORT_GROUPS = {
+    "product": ("product", {"product_name": F("product__name")}),
+    "category": ("category", {"category_name": F("category__name")}),
+    "seller": ("seller", {"seller_username": F("seller__username")}),
+}
+
+REPORT_PERIODS = {
+    "day": F("date"),
+    "month": TruncMonth("date"),
+    "year": TruncYear("date"),
+}
+
+VALUATION_TOTALS = (
+    "quantity",
+    "value_at_cost",
+    "value_at_sale_price",
+    "potential_margin",
+)
+
+
+class ReportError(Exception):
+    """Raised with DRF-like errors keyed by the offending query parameter"""
+
+    def __init__(self, errors: dict):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def parse_date_range(params) -> Tuple[Optional[date], Optional[date]]:
+    try:
+        return tuple(
+            date.fromisoformat(params[name]) if params.get(name) else None
+            for name in ("date_from", "date_to")
+        )
+    except ValueError:
+        raise ReportError({"non_field_errors": "Fecha inválida"})
+
+
+def sales_report_rows(params) -> QuerySet:
+    """Rollups grouped by ``period`` and ``group_by``, the query is not run yet so
+    it can be evaluated by sync and async views alike"""
+    period = params.get("period", "month")
+    group_by = [group for group in params.get("group_by", "").split(",") if group]
+
+    if period not in REPORT_PERIODS:
+        raise ReportError({"period": f"Debe ser uno de: {', '.join(REPORT_PERIODS)}"})
+    if any(group not in REPORT_GROUPS for group in group_by):
+        raise ReportError(
+            {"group_by": f"Debe ser una lista de: {', '.join(REPORT_GROUPS)}"}
+        )
+
+    rollups = DailySalesRollup.objects.all()
+    date_from, date_to = parse_date_range(params)
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+
+    columns = [REPORT_GROUPS[group][0] for group in group_by]
+    names = {"period": REPORT_PERIODS[period]}
+    for group in group_by:
+        names.update(REPORT_GROUPS[group][1])
+
+    return (
+        rollups.values(*columns, **names)
+        .annotate(units=Sum("units"), revenue=Sum("revenue"), cost=Sum("cost"))
+        .annotate(margin=F("revenue") - F("cost"))
+        .order_by("period", *columns)
+    )
+
+
+def valuation_params(params) -> Tuple[str, Optional[date]]:
+    group_by = params.get("group_by", "product")
+
+    if group_by not in VALUATION_GROUPS:
+        raise ReportError(
+            {"group_by": f"Debe ser uno de: {', '.join(VALUATION_GROUPS)}"}
+        )
+    try:
+        as_of = date.fromisoformat(params["as_of"]) if params.get("as_of") else None
+    except ValueError:
+        raise ReportError({"as_of": "Fecha inválida"})
+    return group_by, as_of
+
+
+def valuation_totals(rows: List[dict]) -> dict:
+    return {field: sum(row[field] or 0 for row in rows) for field in VALUATION_TOTALS}
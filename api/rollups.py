@@ -0,0 +1,178 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    IntegerField,
+    QuerySet,
+    Sum,
+    Value,
+    When,
+)
+
+from api.models import BatchSale, DailySalesRollup
+
+CENT = Decimal("0.01")
+REBUILD_CHUNK_SIZE = 2000
+
+
+@dataclass
+class RollupDelta:
+    units: int = 0
+    revenue: Decimal = Decimal(0)
+    cost: Decimal = Decimal(0)
+
+    def add(self, quantity: int, unit_price: float, buy_price: Decimal):
+        self.units += quantity
+        self.revenue += (Decimal(str(unit_price)) * quantity).quantize(CENT)
+        self.cost += buy_price * quantity
+
+    def __neg__(self) -> "RollupDelta":
+        return RollupDelta(-self.units, -self.revenue, -self.cost)
+
+
+def apply_rollup_deltas(
+    day: date,
+    seller_id: int,
+    deltas: Dict[int, RollupDelta],
+    categories: Optional[Dict[int, int]] = None,
+):
+    """Adds the per-product ``deltas`` to the rollups of a day and seller
+
+    Costs two statements whatever the number of products: an insert of the missing
+    rows (only when ``categories`` of the products are given) and one UPDATE.
+    """
+    if not deltas:
+        return
+
+    if categories is not None:
+        DailySalesRollup.objects.bulk_create(
+            [
+                DailySalesRollup(
+                    date=day,
+                    seller_id=seller_id,
+                    product_id=product_id,
+                    category_id=categories[product_id],
+                )
+                for product_id in deltas
+            ],
+            ignore_conflicts=True,
+        )
+
+    def increment(field: str, output_field):
+        return F(field) + Case(
+            *[
+                When(product_id=product_id, then=Value(getattr(delta, field)))
+                for product_id, delta in deltas.items()
+            ],
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    money = DecimalField(max_digits=14, decimal_places=2)
+    DailySalesRollup.objects.filter(
+        date=day, seller_id=seller_id, product_id__in=deltas.keys()
+    ).update(
+        units=increment("units", IntegerField()),
+        revenue=increment("revenue", money),
+        cost=increment("cost", money),
+    )
+
+
+def rollup_totals(batch_sales: QuerySet) -> QuerySet:
+    """Sums ``batch_sales`` per day, seller and product in SQL"""
+    return (
+        batch_sales.values(
+            day=F("sale_history__complete_sale__date_sold"),
+            seller=F("sale_history__complete_sale__sold_by"),
+            product=F("batch__product"),
+            category=F("batch__product__category"),
+        )
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(
+                ExpressionWrapper(
+                    F("quantity") * F("sale_history__unit_price"),
+                    output_field=FloatField(),
+                )
+            ),
+            cost=Sum(
+                ExpressionWrapper(
+                    F("quantity") * F("batch__buy_price"),
+                    output_field=DecimalField(max_digits=14, decimal_places=2),
+                )
+            ),
+        )
+        .order_by()
+    )
+
+
+def subtract_batch_sales(batch_sales: QuerySet) -> Dict[int, int]:
+    """Takes ``batch_sales`` out of the rollups and returns the units per product
+
+    The batch sales are summed in SQL, then every day and seller they touch costs
+    one UPDATE.
+    """
+    units: Dict[int, int] = defaultdict(int)
+    deltas: Dict[Tuple[date, int], Dict[int, RollupDelta]] = defaultdict(dict)
+    for row in rollup_totals(batch_sales):
+        units[row["product"]] += row["units"]
+        deltas[row["day"], row["seller"]][row["product"]] = RollupDelta(
+            -row["units"],
+            -Decimal(str(row["revenue"])).quantize(CENT),
+            -row["cost"],
+        )
+
+    for (day, seller_id), product_deltas in deltas.items():
+        apply_rollup_deltas(day, seller_id, product_deltas)
+    return units
+
+
+@transaction.atomic
+def rebuild_rollups(date_from: date = None, date_to: date = None) -> int:
+    """Recomputes the rollups of the date range from the batch sales"""
+    rollups = DailySalesRollup.objects.all()
+    batch_sales = BatchSale.objects.filter(sale_history__complete_sale__reverted=False)
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+        batch_sales = batch_sales.filter(
+            sale_history__complete_sale__date_sold__gte=date_from
+        )
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+        batch_sales = batch_sales.filter(
+            sale_history__complete_sale__date_sold__lte=date_to
+        )
+
+    rollups.delete()
+
+    rows = rollup_totals(batch_sales)
+
+    created = 0
+    chunk = []
+    for row in rows.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        chunk.append(
+            DailySalesRollup(
+                date=row["day"],
+                seller_id=row["seller"],
+                product_id=row["product"],
+                category_id=row["category"],
+                units=row["units"],
+                revenue=Decimal(str(row["revenue"])).quantize(CENT),
+                cost=row["cost"],
+            )
+        )
+        if len(chunk) == REBUILD_CHUNK_SIZE:
+            created += len(DailySalesRollup.objects.bulk_create(chunk))
+            chunk = []
+    created += len(DailySalesRollup.objects.bulk_create(chunk))
+
+    return created
@@ -0,0 +1,605 @@
+import logging
+import random
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+
+from api.allocation import get_strategy
+from api.models import (
+    Batch,
+    BatchSale,
+    BatchSaleReturn,
+    CompleteSale,
+    Product,
+    SaleHistory,
+)
+from api.rollups import RollupDelta, apply_rollup_deltas, subtract_batch_sales
+from api.signals import sales_changed
+from api.stock import adjust_product_stock, restock_batches, restock_sold_batches
+
+logger = logging.getLogger(__name__)
+
+# serialization_failure and deadlock_detected
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+VOID_REVERTED = "reverted"
+VOID_ALREADY_REVERTED = "already_reverted"
+VOID_NOT_FOUND = "not_found"
+
+
+class SaleError(Exception):
+    """Raised with DRF-like errors keyed by the index of the offending cart line"""
+
+    def __init__(self, errors: dict):
+        super().__init__(errors)
+        self.errors = errors
+
+
+@dataclass
+class CartLine:
+    index: int
+    product: Product
+    quantity: int
+    allocations: List[Tuple[Batch, int]] = field(default_factory=list)
+
+
+@dataclass
+class ReturnLine:
+    index: int
+    sale_history_id: int
+    # None returns every unit left in the line.
+    quantity: Optional[int]
+
+
+@dataclass
+class Checkout:
+    complete_sale: CompleteSale
+    attempts: int
+    lock_wait: float
+    # The sale had already been submitted with the same uuid.
+    duplicate: bool = False
+
+
+def parse_cart(cart: List[dict]) -> List[Tuple[int, int, int]]:
+    """Returns ``(index, product_id, quantity)`` for every line, raising KeyError on
+    missing fields and SaleError on malformed ones"""
+    if not cart:
+        raise SaleError({"non_field_errors": "La venta no tiene productos"})
+
+    parsed = []
+    for index, product_dict in enumerate(cart):
+        if not isinstance(product_dict, dict):
+            raise SaleError(
+                {index: {"non_field_errors": "Se esperaba un producto y una cantidad"}}
+            )
+        try:
+            product_id = int(product_dict["product"])
+        except (TypeError, ValueError):
+            raise SaleError({index: {"product": "Producto inválido"}})
+        try:
+            quantity = int(product_dict["quantity"])
+        except (TypeError, ValueError):
+            raise SaleError({index: {"quantity": "Debe ser un número entero"}})
+
+        if quantity <= 0:
+            raise SaleError(
+                {index: {"quantity": "No puedes vender una cantidad negativa"}}
+            )
+        parsed.append((index, product_id, quantity))
+
+    return parsed
+
+
+def load_open_batches(
+    product_ids: Iterable[int], lock: bool = False
+) -> Tuple[Dict[int, List[Batch]], float]:
+    """Open batches of all the products in allocation order, fetched with one query
+
+    The order comes from ``BATCH_ALLOCATION_STRATEGY``. With ``lock`` the rows are
+    locked in that same deterministic order, so concurrent checkouts touching the
+    same products cannot deadlock. Also returns the seconds spent fetching (waiting
+    for) the rows.
+    """
+    queryset = get_strategy().open_batches(product_ids)
+    if lock:
+        queryset = queryset.select_for_update()
+
+    started = time.perf_counter()
+    open_batches = list(queryset)
+    lock_wait = time.perf_counter() - started
+
+    batches: Dict[int, List[Batch]] = defaultdict(list)
+    for batch in open_batches:
+        batches[batch.product_id].append(batch)
+    return batches, lock_wait
+
+
+def check_availability(lines: List[CartLine], batches: Dict[int, List[Batch]]):
+    requested: Dict[int, int] = defaultdict(int)
+    for line in lines:
+        requested[line.product.id] += line.quantity
+        available = sum(batch.quantity for batch in batches[line.product.id])
+        if available < requested[line.product.id]:
+            raise SaleError(
+                {
+                    line.index: {
+                        "quantity": "No hay suficiente cantidad en el inventario"
+                    }
+                }
+            )
+
+
+def allocate(lines: List[CartLine], batches: Dict[int, List[Batch]]) -> List[Batch]:
+    """Assigns batch quantities to every line in memory and returns the touched batches"""
+    check_availability(lines, batches)
+    touched: Dict[int, Batch] = {}
+
+    for line in lines:
+        remaining = line.quantity
+        for batch in batches[line.product.id]:
+            if batch.quantity == 0:
+                continue
+            sell_quantity = min(batch.quantity, remaining)
+            batch.quantity -= sell_quantity
+            remaining -= sell_quantity
+            line.allocations.append((batch, sell_quantity))
+            touched[batch.id] = batch
+
+            if remaining == 0:
+                break
+
+    return list(touched.values())
+
+
+def build_cart(cart: List[dict]) -> List[CartLine]:
+    parsed = parse_cart(cart)
+    products = Product.objects.in_bulk({product_id for _, product_id, _ in parsed})
+
+    lines = []
+    for index, product_id, quantity in parsed:
+        product = products.get(product_id)
+        if product is None:
+            raise SaleError({index: {"product": "El producto no existe"}})
+        lines.append(CartLine(index=index, product=product, quantity=quantity))
+
+    return lines
+
+
+def decrement_optimistically(lines: List[CartLine], batches: Dict[int, List[Batch]]):
+    """Allocates every line with guarded ``quantity = quantity - n WHERE quantity >= n``
+    updates instead of locking the batches up front
+
+    When a guard fails because a concurrent sale took part of the batch, the batch is
+    re-read and whatever is left of it is taken before falling through to the next one.
+    """
+    check_availability(lines, batches)
+
+    for line in lines:
+        remaining = line.quantity
+        for batch in batches[line.product.id]:
+            while remaining and batch.quantity:
+                sell_quantity = min(batch.quantity, remaining)
+                updated = Batch.objects.filter(
+                    pk=batch.pk, quantity__gte=sell_quantity
+                ).update(quantity=F("quantity") - sell_quantity)
+
+                if not updated:
+                    batch.refresh_from_db(fields=["quantity"])
+                    continue
+
+                batch.quantity -= sell_quantity
+                remaining -= sell_quantity
+                line.allocations.append((batch, sell_quantity))
+
+            if remaining == 0:
+                break
+
+        if remaining:
+            raise SaleError(
+                {
+                    line.index: {
+                        "quantity": "No hay suficiente cantidad en el inventario"
+                    }
+                }
+            )
+
+
+def is_retryable(error: DatabaseError) -> bool:
+    cause = error.__cause__
+    sqlstate = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+def parse_sale_uuid(value) -> Optional[uuid.UUID]:
+    if value is None:
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise SaleError({"uuid": "Introduzca un UUID válido"})
+
+
+def find_submitted_sale(sale_uuid: uuid.UUID, user: User) -> Optional[Checkout]:
+    complete_sale = CompleteSale.objects.filter(uuid=sale_uuid).first()
+    if complete_sale is None:
+        return None
+    if complete_sale.sold_by_id != user.id:
+        raise SaleError({"uuid": "Este identificador pertenece a otra venta"})
+    return Checkout(complete_sale, attempts=0, lock_wait=0.0, duplicate=True)
+
+
+def write_sale(
+    lines: List[CartLine], user: User, sale_uuid: Optional[uuid.UUID] = None
+) -> CompleteSale:
+    complete_sale = CompleteSale.objects.create(sold_by=user, uuid=sale_uuid)
+    sale_histories = SaleHistory.objects.bulk_create(
+        [
+            SaleHistory(unit_price=line.product.sale_price, complete_sale=complete_sale)
+            for line in lines
+        ]
+    )
+
+    batch_sales: List[BatchSale] = []
+    stock_deltas: Dict[int, int] = defaultdict(int)
+    rollup_deltas: Dict[int, RollupDelta] = defaultdict(RollupDelta)
+    for line, sale_history in zip(lines, sale_histories):
+        for batch, quantity in line.allocations:
+            batch_sales.append(
+                BatchSale(batch=batch, quantity=quantity, sale_history=sale_history)
+            )
+            rollup_deltas[line.product.id].add(
+                quantity, sale_history.unit_price, batch.buy_price
+            )
+        stock_deltas[line.product.id] -= line.quantity
+
+    BatchSale.objects.bulk_create(batch_sales)
+    adjust_product_stock(stock_deltas)
+    apply_rollup_deltas(
+        complete_sale.date_sold,
+        user.id,
+        rollup_deltas,
+        categories={line.product.id: line.product.category_id for line in lines},
+    )
+    sales_changed.send(
+        sender=CompleteSale, complete_sale_ids=[complete_sale.id], action="sold"
+    )
+
+    return complete_sale
+
+
+def sell_cart(
+    cart: List[dict], user: User, sale_uuid: Optional[uuid.UUID] = None
+) -> Checkout:
+    """Sells a whole cart atomically
+
+    With ``CHECKOUT_STOCK_MODE = "lock"`` the open batches of the cart products stay
+    locked until the sale is written and the whole cart costs a constant number of
+    queries. With ``"optimistic"`` nothing is locked up front and every batch is
+    decremented with a guarded UPDATE, which keeps hot products from serializing
+    every checkout. Either way concurrent checkouts cannot oversell. Serialization
+    failures and deadlocks are retried with exponential backoff unless we are
+    nested in an outer transaction.
+
+    A sale submitted again with the same ``sale_uuid`` is not sold twice, the
+    first one is returned as a duplicate instead.
+    """
+    if sale_uuid is not None:
+        checkout = find_submitted_sale(sale_uuid, user)
+        if checkout:
+            return checkout
+
+    lines = build_cart(cart)
+    product_ids = {line.product.id for line in lines}
+    can_retry = not connection.in_atomic_block
+    attempt = 0
+    lock_wait = 0.0
+
+    while True:
+        attempt += 1
+        for line in lines:
+            line.allocations.clear()
+
+        try:
+            with transaction.atomic():
+                if settings.CHECKOUT_STOCK_MODE == "optimistic":
+                    batches, _ = load_open_batches(product_ids)
+                    decrement_optimistically(lines, batches)
+                else:
+                    batches, attempt_lock_wait = load_open_batches(
+                        product_ids, lock=True
+                    )
+                    lock_wait += attempt_lock_wait
+                    touched_batches = allocate(lines, batches)
+                    Batch.objects.bulk_update(touched_batches, ["quantity"])
+                complete_sale = write_sale(lines, user, sale_uuid)
+            break
+        except IntegrityError:
+            # A concurrent submission of the same sale was written first.
+            checkout = sale_uuid and find_submitted_sale(sale_uuid, user)
+            if checkout:
+                return checkout
+            raise
+        except DatabaseError as e:
+            if (
+                not can_retry
+                or not is_retryable(e)
+                or attempt > settings.CHECKOUT_MAX_RETRIES
+            ):
+                raise
+            delay = settings.CHECKOUT_RETRY_BACKOFF * 2 ** (attempt - 1)
+            logger.warning("Checkout attempt %s failed (%s), retrying", attempt, e)
+            time.sleep(delay * (1 + random.random()))
+
+    logger.info(
+        "Sale %s completed in %s attempt(s), lock wait %.1fms",
+        complete_sale.id,
+        attempt,
+        lock_wait * 1000,
+    )
+    return Checkout(complete_sale=complete_sale, attempts=attempt, lock_wait=lock_wait)
+
+
+def submit_sales(queue: List[dict], user: User) -> List[dict]:
+    """Sells a queue of sales buffered by a terminal, in order and each one in its
+    own transaction, and returns the outcome of every sale
+
+    Every sale needs its ``uuid``, so flushing the same queue again after a lost
+    response only reports the already sold ones as duplicates.
+    """
+    outcomes = []
+    for sale in queue:
+        sale_uuid = sale.get("uuid") if isinstance(sale, dict) else None
+        try:
+            if sale_uuid is None:
+                raise SaleError({"uuid": "Este campo es requerido"})
+            if not isinstance(sale.get("lines"), list):
+                raise SaleError({"lines": "Se esperaba una lista de productos"})
+            checkout = sell_cart(sale["lines"], user, parse_sale_uuid(sale_uuid))
+        except SaleError as e:
+            outcomes.append(
+                {"uuid": sale_uuid, "status": "rejected", "errors": e.errors}
+            )
+        except KeyError as e:
+            outcomes.append(
+                {
+                    "uuid": sale_uuid,
+                    "status": "rejected",
+                    "errors": {str(e): "Este campo es requerido"},
+                }
+            )
+        except (TypeError, ValueError):
+            # Anything malformed that got past parse_cart only rejects this sale.
+            logger.exception("Malformed sale %s in a batch", sale_uuid)
+            outcomes.append(
+                {
+                    "uuid": sale_uuid,
+                    "status": "rejected",
+                    "errors": {"non_field_errors": "Venta con formato inválido"},
+                }
+            )
+        else:
+            outcomes.append(
+                {
+                    "uuid": sale_uuid,
+                    "status": "duplicate" if checkout.duplicate else "sold",
+                    "sale_id": checkout.complete_sale.id,
+                }
+            )
+    return outcomes
+
+
+def parse_return(lines: List[dict]) -> List[ReturnLine]:
+    """Parses the lines of a partial revert, raising KeyError on missing fields and
+    SaleError on malformed ones"""
+    if not isinstance(lines, list) or not lines:
+        raise SaleError({"lines": "Se esperaba una lista de líneas"})
+
+    parsed = []
+    for index, line in enumerate(lines):
+        if not isinstance(line, dict):
+            raise SaleError(
+                {index: {"non_field_errors": "Se esperaba una línea y una cantidad"}}
+            )
+        try:
+            sale_history_id = int(line["sale_history"])
+        except (TypeError, ValueError):
+            raise SaleError({index: {"sale_history": "Línea inválida"}})
+
+        quantity = line.get("quantity")
+        if quantity is not None:
+            try:
+                quantity = int(quantity)
+            except (TypeError, ValueError):
+                raise SaleError({index: {"quantity": "Debe ser un número entero"}})
+            if quantity <= 0:
+                raise SaleError(
+                    {index: {"quantity": "No puedes devolver una cantidad negativa"}}
+                )
+        parsed.append(ReturnLine(index, sale_history_id, quantity))
+
+    return parsed
+
+
+def take_returned_units(
+    batch_sales: List[BatchSale], returns: List[ReturnLine]
+) -> List[Tuple[BatchSale, int]]:
+    """Picks the units of every returned line from its batch sales, those allocated
+    last are given back first"""
+    by_line: Dict[int, List[BatchSale]] = defaultdict(list)
+    for batch_sale in batch_sales:
+        by_line[batch_sale.sale_history_id].append(batch_sale)
+
+    left = {batch_sale.id: batch_sale.quantity for batch_sale in batch_sales}
+    returned: Dict[int, int] = defaultdict(int)
+    for line in returns:
+        line_batch_sales = by_line.get(line.sale_history_id)
+        if not line_batch_sales:
+            raise SaleError(
+                {line.index: {"sale_history": "La línea no pertenece a esta venta"}}
+            )
+
+        remaining = line.quantity
+        if remaining is None:
+            remaining = sum(left[batch_sale.id] for batch_sale in line_batch_sales)
+            if not remaining:
+                raise SaleError(
+                    {line.index: {"sale_history": "La línea ya fue devuelta"}}
+                )
+        for batch_sale in reversed(line_batch_sales):
+            quantity = min(left[batch_sale.id], remaining)
+            left[batch_sale.id] -= quantity
+            returned[batch_sale.id] += quantity
+            remaining -= quantity
+
+        if remaining:
+            raise SaleError(
+                {line.index: {"quantity": "No puedes devolver más de lo vendido"}}
+            )
+
+    return [
+        (batch_sale, returned[batch_sale.id])
+        for batch_sale in batch_sales
+        if returned[batch_sale.id]
+    ]
+
+
+def restore_units(complete_sale: CompleteSale, returned: List[Tuple[BatchSale, int]]):
+    """Puts the returned units back in their batches, product stock and rollups,
+    one grouped UPDATE each"""
+    batch_deltas: Dict[int, int] = defaultdict(int)
+    stock_deltas: Dict[int, int] = defaultdict(int)
+    rollup_deltas: Dict[int, RollupDelta] = defaultdict(RollupDelta)
+    for batch_sale, quantity in returned:
+        batch_deltas[batch_sale.batch_id] += quantity
+        stock_deltas[batch_sale.batch.product_id] += quantity
+        rollup_deltas[batch_sale.batch.product_id].add(
+            quantity, batch_sale.sale_history.unit_price, batch_sale.batch.buy_price
+        )
+
+    restock_batches(batch_deltas)
+    adjust_product_stock(stock_deltas)
+    apply_rollup_deltas(
+        complete_sale.date_sold,
+        complete_sale.sold_by_id,
+        {product_id: -delta for product_id, delta in rollup_deltas.items()},
+    )
+
+
+def record_returns(returned: List[Tuple[BatchSale, int]]):
+    """Takes the returned units off the batch sales and records them as returns of
+    the day, the batch sales and sale histories stay as they were sold"""
+    for batch_sale, quantity in returned:
+        batch_sale.quantity -= quantity
+
+    BatchSale.objects.bulk_update(
+        [batch_sale for batch_sale, _ in returned], ["quantity"]
+    )
+    BatchSaleReturn.objects.bulk_create(
+        [
+            BatchSaleReturn(batch_sale=batch_sale, quantity=quantity)
+            for batch_sale, quantity in returned
+        ]
+    )
+
+
+def void_sales(complete_sale_ids: Iterable[int]) -> Dict[int, str]:
+    """Reverts many whole sales at once and returns what happened to each one
+
+    The sales are locked in id order, so concurrent voids can neither deadlock nor
+    give the same units back twice. Whatever the number of sales, the batches and
+    the product stock are restored with one grouped UPDATE each, summed in SQL,
+    and the rollups with one UPDATE per day and seller.
+    """
+    complete_sale_ids = set(complete_sale_ids)
+
+    with transaction.atomic():
+        reverted = dict(
+            CompleteSale.objects.select_for_update()
+            .filter(pk__in=complete_sale_ids)
+            .order_by("id")
+            .values_list("id", "reverted")
+        )
+        to_void = [pk for pk, is_reverted in reverted.items() if not is_reverted]
+        if to_void:
+            batch_sales = BatchSale.objects.filter(
+                sale_history__complete_sale__in=to_void
+            )
+            restock_sold_batches(batch_sales)
+            adjust_product_stock(subtract_batch_sales(batch_sales))
+            CompleteSale.objects.filter(pk__in=to_void).update(
+                reverted=True, reverted_on=date.today()
+            )
+            sales_changed.send(
+                sender=CompleteSale, complete_sale_ids=to_void, action="reverted"
+            )
+
+    return {
+        pk: (
+            VOID_NOT_FOUND
+            if pk not in reverted
+            else VOID_ALREADY_REVERTED if reverted[pk] else VOID_REVERTED
+        )
+        for pk in sorted(complete_sale_ids)
+    }
+
+
+def revert_complete_sale(complete_sale_id: int, lines: Optional[List[dict]] = None):
+    """Returns the units of a whole sale, or only of some of its ``lines``, to stock
+
+    A whole revert goes through ``void_sales``, it keeps the sale rows and flags the
+    sale ``reverted``, reverting an already reverted sale does nothing. A partial
+    revert locks the sale, reads its batch sales with one query, restores batches,
+    product stock and rollups with one UPDATE each and records the returned units
+    as dated returns of their batch sales, unless it returns everything that is
+    left, which reverts the whole sale.
+    """
+    try:
+        complete_sale_id = int(complete_sale_id)
+    except (TypeError, ValueError):
+        raise SaleError({"sale_id": "La venta no existe"})
+
+    if lines is None:
+        if void_sales([complete_sale_id])[complete_sale_id] == VOID_NOT_FOUND:
+            raise SaleError({"sale_id": "La venta no existe"})
+        return
+
+    returns = parse_return(lines)
+    with transaction.atomic():
+        try:
+            complete_sale = CompleteSale.objects.select_for_update().get(
+                pk=complete_sale_id
+            )
+        except CompleteSale.DoesNotExist:
+            raise SaleError({"sale_id": "La venta no existe"})
+        if complete_sale.reverted:
+            raise SaleError({"sale_id": "La venta ya fue revertida"})
+
+        batch_sales = list(
+            BatchSale.objects.filter(sale_history__complete_sale=complete_sale)
+            .select_related("batch", "sale_history")
+            .order_by("id")
+        )
+        returned = take_returned_units(batch_sales, returns)
+
+        restore_units(complete_sale, returned)
+        if sum(quantity for _, quantity in returned) == sum(
+            batch_sale.quantity for batch_sale in batch_sales
+        ):
+            complete_sale.reverted = True
+            complete_sale.reverted_on = date.today()
+            complete_sale.save(update_fields=["reverted", "reverted_on"])
+            action = "reverted"
+        else:
+            record_returns(returned)
+            action = "returned"
+        sales_changed.send(
+            sender=CompleteSale, complete_sale_ids=[complete_sale.id], action=action
+        )
@@ -17,6 +17,7 @@ class BatchSerializer(ModelSerializer):
     def to_representation(self, instance: Batch):
         obj = super().to_representation(instance)
         obj["product_name"] = instance.product.name
+        obj["days_until_obsolete"] = instance.days_until_obsolete
         return obj
 
     def create(self, validated_data):
@@ -25,6 +26,21 @@ class BatchSerializer(ModelSerializer):
         return super().create(validated_data)
 
 
+class BatchReceiveSerializer(serializers.Serializer):
+    """One line of a purchase order, products are resolved in bulk by the view"""
+
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+    buy_price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0)
+    obsolete_date = serializers.DateField(required=False, allow_null=True)
+
+
+class VoidSalesSerializer(serializers.Serializer):
+    """Sales to void, without ``sale_ids`` the body holds CompleteSaleFilter fields"""
+
+    sale_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+
 class CategorySerializer(ModelSerializer):
     class Meta:
         model = Category
@@ -39,12 +55,13 @@ class ProductSerializer(ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
+        extra_kwargs = {"stock": {"read_only": True}}
 
     def to_representation(self, instance: Product, *args, **kwargs):
         obj = super().to_representation(instance)
         obj["category"] = instance.category.name
-        # obj["is_inventory_low"] = instance.is_inventory_low
-        obj["quantity"] = instance.quantity
+        obj["is_inventory_low"] = instance.is_inventory_low
+        obj["quantity"] = instance.stock
 
         return obj
 
@@ -70,13 +87,12 @@ class SaleHistorySerializer(ModelSerializer):
 
     def to_representation(self, instance: SaleHistory):
         obj = super().to_representation(instance)
-        product = instance.batch_sales.first().batch.product
         obj["quantity_sold"] = instance.quantity_sold
         obj["total_sold"] = instance.total_sold
         obj["total_cost"] = instance.total_cost
         obj["total_renevue"] = instance.total_renevue
-        obj["product_name"] = product.name
-        obj["category_name"] = product.category.name
+        obj["product_name"] = instance.product_name
+        obj["category_name"] = instance.category_name
         return obj
 
 
@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# Sent with ``product_ids`` by ``api.stock`` whenever it moves the stock of products,
+# those bulk updates bypass the model signals.
+stock_changed = Signal()
+
+# Sent with ``product_ids`` by bulk writes of products or categories that bypass the
+# model signals.
+catalog_changed = Signal()
+
+# Sent with ``complete_sale_ids`` and ``action``, "sold", "returned" or "reverted",
+# when sales are written or reverted.
+sales_changed = Signal()
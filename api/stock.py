@@ -0,0 +1,220 @@
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from django.db.models import (
+    Case,
+    DecimalField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    QuerySet,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+
+from api.models import LOW_STOCK, Batch, BatchSale, BatchSaleReturn, Product
+from api.signals import stock_changed
+
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+VALUATION_GROUPS = {
+    "product": {
+        "product_name": F("product__name"),
+        "category": F("product__category"),
+        "category_name": F("product__category__name"),
+    },
+    "category": {
+        "category": F("product__category"),
+        "category_name": F("product__category__name"),
+    },
+}
+
+
+def batch_stock_subquery(product_ref: str = "pk") -> Coalesce:
+    """Sum of the remaining batch quantities of the product referenced by ``product_ref``"""
+    return Coalesce(
+        Subquery(
+            Batch.objects.filter(product=OuterRef(product_ref))
+            .order_by()
+            .values("product")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def sync_product_stock(product_ids: Iterable[int]) -> int:
+    """Recomputes ``Product.stock`` from its batches, then refreshes the low stock
+    flags, one UPDATE each"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    products = Product.objects.filter(pk__in=product_ids)
+    updated = products.update(stock=batch_stock_subquery())
+    products.update(is_low_stock=LOW_STOCK)
+    stock_changed.send(sender=Product, product_ids=product_ids)
+    return updated
+
+
+def adjust_product_stock(deltas: Dict[int, int]) -> int:
+    """Adds ``deltas[product_id]`` to each product stock, then refreshes their
+    low stock flags, one UPDATE each"""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    products = Product.objects.filter(pk__in=deltas.keys())
+    updated = products.update(
+        stock=F("stock")
+        + Case(
+            *[
+                When(pk=product_id, then=Value(delta))
+                for product_id, delta in deltas.items()
+            ],
+            default=Value(0),
+        )
+    )
+    products.update(is_low_stock=LOW_STOCK)
+    stock_changed.send(sender=Product, product_ids=deltas.keys())
+    return updated
+
+
+def restock_batches(deltas: Dict[int, int]) -> int:
+    """Adds ``deltas[batch_id]`` back to each batch quantity with one UPDATE"""
+    deltas = {batch_id: delta for batch_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    return Batch.objects.filter(pk__in=deltas.keys()).update(
+        quantity=F("quantity")
+        + Case(
+            *[
+                When(pk=batch_id, then=Value(delta))
+                for batch_id, delta in deltas.items()
+            ],
+            default=Value(0),
+        )
+    )
+
+
+def restock_sold_batches(batch_sales: QuerySet) -> int:
+    """Gives the units of ``batch_sales`` back to their batches with one UPDATE,
+    summed per batch in SQL"""
+    return Batch.objects.filter(pk__in=batch_sales.values("batch")).update(
+        quantity=F("quantity")
+        + Subquery(
+            batch_sales.filter(batch=OuterRef("pk"))
+            .order_by()
+            .values("batch")
+            .annotate(total=Sum("quantity"))
+            .values("total")
+        )
+    )
+
+
+def receive_batches(lines: List[dict], user: User) -> List[Batch]:
+    """Inserts the batches of a purchase order and updates each product stock once
+
+    ``lines`` hold validated BatchReceiveSerializer data with ``product`` already
+    replaced by its instance.
+    """
+    with transaction.atomic():
+        batches = Batch.objects.bulk_create(
+            [
+                Batch(
+                    product=line["product"],
+                    quantity=line["quantity"],
+                    initial_quantity=line["quantity"],
+                    buy_price=line["buy_price"],
+                    obsolete_date=line.get("obsolete_date"),
+                    bought_by=user,
+                )
+                for line in lines
+            ]
+        )
+        sync_product_stock(batch.product_id for batch in batches)
+    return batches
+
+
+def inventory_valuation(group_by: str, as_of: Optional[date] = None) -> QuerySet:
+    """Remaining units valued at cost and at sale price, in one grouped query
+
+    With ``as_of`` the stock of every batch received up to that day is rebuilt as
+    its current quantity plus what non-reverted sales took from it afterwards,
+    minus what sales made up to that day gave back afterwards, reverted whole or
+    returned in part. Manual edits of batch quantities are not part of the
+    history: they count as if they had always been there.
+    """
+    names = VALUATION_GROUPS[group_by]
+    batches = Batch.objects.all()
+    quantity = F("quantity")
+
+    if as_of is not None:
+        batches = batches.filter(date_created__lte=as_of).annotate(
+            taken_later=Coalesce(
+                Subquery(
+                    BatchSale.objects.filter(batch=OuterRef("pk"))
+                    .order_by()
+                    .values("batch")
+                    .annotate(
+                        total=Sum(
+                            Case(
+                                When(
+                                    sale_history__complete_sale__date_sold__gt=as_of,
+                                    sale_history__complete_sale__reverted=False,
+                                    then=F("quantity"),
+                                ),
+                                When(
+                                    sale_history__complete_sale__date_sold__lte=as_of,
+                                    sale_history__complete_sale__reverted_on__gt=as_of,
+                                    then=-F("quantity"),
+                                ),
+                                default=0,
+                            )
+                        )
+                    )
+                    .values("total")
+                ),
+                0,
+            )
+        )
+        batches = batches.annotate(
+            returned_later=Coalesce(
+                Subquery(
+                    BatchSaleReturn.objects.filter(
+                        batch_sale__batch=OuterRef("pk"),
+                        batch_sale__sale_history__complete_sale__date_sold__lte=as_of,
+                        returned_on__gt=as_of,
+                    )
+                    .order_by()
+                    .values("batch_sale__batch")
+                    .annotate(total=Sum("quantity"))
+                    .values("total")
+                ),
+                0,
+            )
+        )
+        quantity = F("quantity") + F("taken_later") - F("returned_later")
+
+    return (
+        batches.values(*(["product"] if group_by == "product" else []), **names)
+        .annotate(
+            # Values first, an annotation named quantity shadows the field for F().
+            value_at_cost=Sum(
+                ExpressionWrapper(quantity * F("buy_price"), output_field=MONEY)
+            ),
+            value_at_sale_price=Sum(
+                ExpressionWrapper(
+                    quantity * F("product__sale_price"), output_field=MONEY
+                )
+            ),
+        )
+        .annotate(quantity=Sum(quantity))
+        .annotate(potential_margin=F("value_at_sale_price") - F("value_at_cost"))
+        .order_by(*names)
+    )
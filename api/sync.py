@@ -0,0 +1,115 @@
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db.models import Max, Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api.models import Category, Product, ProductChange
+from api.signals import catalog_changed, stock_changed
+
+
+@dataclass
+class ChangeSet:
+    token: int
+    # True when the terminal must drop its catalog and keep ``products`` only.
+    full: bool
+    more: bool = False
+    products: List[Product] = field(default_factory=list)
+    deleted: List[int] = field(default_factory=list)
+
+
+def record_product_changes(product_ids: Iterable[int]):
+    """Appends the products to the change log in the transaction of the write"""
+    ProductChange.objects.bulk_create(
+        [ProductChange(product_id=product_id) for product_id in set(product_ids)]
+    )
+
+
+def settled_token(after: int = 0) -> int:
+    """Last token that concurrent transactions can no longer fill in below
+
+    Log ids are taken at insert time but become visible at commit, so the newest
+    ones are sent again on the next sync instead of being skipped forever.
+    """
+    horizon = timezone.now() - timedelta(seconds=settings.PRODUCT_SYNC_SETTLE_SECONDS)
+    return (
+        ProductChange.objects.filter(id__gt=after, changed_at__lte=horizon).aggregate(
+            token=Max("id")
+        )["token"]
+        or after
+    )
+
+
+def catalog_products():
+    return Product.objects.select_related("category").order_by("id")
+
+
+def changes_since(token: Optional[int]) -> ChangeSet:
+    """Products changed after ``token``, or the whole catalog without a token or
+    when the log was pruned past it
+
+    At most ``PRODUCT_SYNC_PAGE_SIZE`` products are returned, ``more`` tells the
+    terminal to ask again right away with the new token.
+    """
+    oldest = ProductChange.objects.aggregate(oldest=Min("id"))["oldest"]
+    if token is None:
+        full = True
+    elif oldest is None:
+        # The whole log was pruned, nothing tells which changes the token missed.
+        full = token != 0
+    else:
+        full = token < oldest - 1
+    if full:
+        return ChangeSet(
+            token=settled_token(), full=True, products=list(catalog_products())
+        )
+
+    limit = settings.PRODUCT_SYNC_PAGE_SIZE
+    changes = list(
+        ProductChange.objects.filter(id__gt=token)
+        .values("product_id")
+        .annotate(last=Max("id"))
+        .order_by("last")[: limit + 1]
+    )
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    next_token = settled_token(token)
+    if more:
+        next_token = min(next_token, changes[-1]["last"])
+
+    product_ids = [change["product_id"] for change in changes]
+    products = list(catalog_products().filter(id__in=product_ids))
+    found = {product.id for product in products}
+    return ChangeSet(
+        token=next_token,
+        full=False,
+        more=more,
+        products=products,
+        deleted=[product_id for product_id in product_ids if product_id not in found],
+    )
+
+
+@receiver(stock_changed)
+@receiver(catalog_changed)
+def log_product_changes(sender, product_ids, **kwargs):
+    record_product_changes(product_ids)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def log_product_write(sender, instance, **kwargs):
+    record_product_changes([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def log_category_write(sender, instance, created, **kwargs):
+    # Products carry their category name.
+    if not created:
+        record_product_changes(
+            Product.objects.filter(category=instance).values_list("id", flat=True)
+        )
@@ -1,3 +1,1319 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gc
+import json
+import tempfile
+import uuid
+import weakref
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from knox.models import AuthToken
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from api.auth import CachedTokenAuthentication
+from api.benchmarks import authenticated_client, measure_checkout, query_growth
+from api.consts import (
+    BATCH_TABLE_HEADERS_WITH_PRODUCT,
+    PRODUCT_TABLE_HEADERS,
+    SALES_TABLE_HEADERS,
+)
+from api.events import EVENTS_PATH, broker, event_stream
+from api.models import (
+    Batch,
+    BatchSale,
+    BatchSaleReturn,
+    Category,
+    CompleteSale,
+    DailySalesRollup,
+    Product,
+    ProductChange,
+    SaleHistory,
+)
+from api.rollups import rebuild_rollups
+from api.sales import (
+    SaleError,
+    build_cart,
+    decrement_optimistically,
+    load_open_batches,
+    sell_cart,
+)
+
+
+class SaleTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Munición")
+        self.product = Product.objects.create(
+            name="9mm", category=category, sale_price=10, alert_quantity=5
+        )
+        for buy_price in (4, 6):
+            self.client.post(
+                "/api/batchs/",
+                {"product": self.product.id, "quantity": 5, "buy_price": buy_price},
+                format="json",
+            )
+
+    def sell(self, quantity: int) -> CompleteSale:
+        response = self.client.post(
+            "/api/sales/sell/",
+            [{"product": self.product.id, "quantity": quantity}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return CompleteSale.objects.latest("id")
+
+
+class SellTests(SaleTestCase):
+    def post_cart(self, cart):
+        return self.client.post("/api/sales/sell/", cart, format="json")
+
+    def batch_quantities(self):
+        return list(
+            Batch.objects.order_by("received_at").values_list("quantity", flat=True)
+        )
+
+    def test_allocates_oldest_batches_first(self):
+        complete_sale = self.sell(7)
+
+        self.assertEqual(self.batch_quantities(), [0, 3])
+        self.assertEqual(
+            sorted(
+                BatchSale.objects.filter(
+                    sale_history__complete_sale=complete_sale
+                ).values_list("batch__buy_price", "quantity")
+            ),
+            [(4, 5), (6, 2)],
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_insufficient_stock_rolls_back(self):
+        other = Product.objects.create(
+            name="12ga", category=self.product.category, sale_price=5
+        )
+        self.client.post(
+            "/api/batchs/",
+            {"product": other.id, "quantity": 5, "buy_price": 2},
+            format="json",
+        )
+
+        response = self.post_cart(
+            [
+                {"product": other.id, "quantity": 2},
+                {"product": self.product.id, "quantity": 11},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(1, response.data)
+        self.assertFalse(CompleteSale.objects.exists())
+        self.assertEqual(self.batch_quantities(), [5, 5, 5])
+        self.assertEqual(
+            dict(Product.objects.values_list("name", "stock")), {"9mm": 10, "12ga": 5}
+        )
+
+    def test_malformed_carts_are_rejected(self):
+        for cart in (
+            [],
+            [{"product": "abc", "quantity": 1}],
+            [{"product": 999, "quantity": 1}],
+            [{"product": self.product.id, "quantity": "two"}],
+            [{"product": self.product.id, "quantity": 0}],
+            ["9mm"],
+            [{"quantity": 1}],
+        ):
+            with self.subTest(cart=cart):
+                self.assertEqual(self.post_cart(cart).status_code, 400)
+        self.assertFalse(CompleteSale.objects.exists())
+
+
+class AllocationTests(SaleTestCase):
+    def allocated(self, complete_sale: CompleteSale) -> dict:
+        return dict(
+            BatchSale.objects.filter(
+                sale_history__complete_sale=complete_sale
+            ).values_list("batch__buy_price", "quantity")
+        )
+
+    def test_fifo_sells_oldest_batches_first(self):
+        self.assertEqual(self.allocated(self.sell(7)), {4: 5, 6: 2})
+
+    @override_settings(BATCH_ALLOCATION_STRATEGY="lifo")
+    def test_lifo_sells_newest_batches_first(self):
+        self.assertEqual(self.allocated(self.sell(7)), {6: 5, 4: 2})
+
+    @override_settings(BATCH_ALLOCATION_STRATEGY="fefo")
+    def test_fefo_sells_first_expiring_batches_first(self):
+        for buy_price, days in ((8, 10), (9, 5)):
+            self.client.post(
+                "/api/batchs/",
+                {
+                    "product": self.product.id,
+                    "quantity": 5,
+                    "buy_price": buy_price,
+                    "obsolete_date": date.today() + timedelta(days=days),
+                },
+                format="json",
+            )
+        self.assertEqual(self.allocated(self.sell(12)), {9: 5, 8: 5, 4: 2})
+
+    def test_never_oversells(self):
+        self.sell(8)
+        response = self.client.post(
+            "/api/sales/sell/",
+            [{"product": self.product.id, "quantity": 3}],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CompleteSale.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+
+
+@override_settings(CHECKOUT_STOCK_MODE="optimistic")
+class OptimisticAllocationTests(AllocationTests):
+    def decrement_stale_batches(self, quantity: int, left_in_first_batch: int):
+        """Allocates ``quantity`` from batches read before a concurrent sale left
+        ``left_in_first_batch`` units in the oldest one"""
+        lines = build_cart([{"product": self.product.id, "quantity": quantity}])
+        batches, _ = load_open_batches([self.product.id])
+        Batch.objects.filter(pk=batches[self.product.id][0].pk).update(
+            quantity=left_in_first_batch
+        )
+        decrement_optimistically(lines, batches)
+        return lines[0].allocations
+
+    def test_failed_guard_rereads_the_batch(self):
+        allocations = self.decrement_stale_batches(7, left_in_first_batch=2)
+
+        self.assertEqual(
+            [(batch.buy_price, quantity) for batch, quantity in allocations],
+            [(4, 2), (6, 5)],
+        )
+        self.assertEqual(
+            list(Batch.objects.order_by("id").values_list("quantity", flat=True)),
+            [0, 0],
+        )
+
+    def test_failed_guard_without_enough_left(self):
+        with self.assertRaises(SaleError):
+            self.decrement_stale_batches(7, left_in_first_batch=1)
+
+
+class LockCheckoutTests(SaleTestCase):
+    def test_open_batches_are_locked_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            checkout = sell_cart(
+                [{"product": self.product.id, "quantity": 7}], self.user
+            )
+
+        self.assertEqual(checkout.attempts, 1)
+        batch_reads = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT") and '"api_batch"' in query["sql"]
+        ]
+        self.assertEqual(len(batch_reads), 1)
+        if connection.features.has_select_for_update:
+            self.assertIn("FOR UPDATE", batch_reads[0])
+        self.assertEqual(
+            list(Batch.objects.order_by("id").values_list("quantity", flat=True)),
+            [0, 3],
+        )
+
+
+class BulkReceiveTests(SaleTestCase):
+    def receive(self, lines):
+        return self.client.post("/api/batchs/bulk_receive/", lines, format="json")
+
+    def test_receives_the_whole_order(self):
+        response = self.receive(
+            [
+                {"product": self.product.id, "quantity": 3, "buy_price": "5.50"},
+                {"product": self.product.id, "quantity": 2, "buy_price": 7},
+            ]
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 15)
+
+    def test_reports_every_line_at_once(self):
+        response = self.receive(
+            [
+                {"product": 999, "quantity": 3, "buy_price": 5},
+                {"product": self.product.id, "quantity": 0, "buy_price": 5},
+                {"product": self.product.id, "quantity": 1, "buy_price": 5},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [set(line_errors) for line_errors in response.data],
+            [{"product"}, {"quantity"}, set()],
+        )
+        self.assertEqual(Batch.objects.count(), 2)
+        self.assertEqual(self.receive({"product": 1}).status_code, 400)
+
+
+class ProductStockTests(SaleTestCase):
+    def assertStock(self, stock: int, is_low_stock: bool):
+        self.product.refresh_from_db()
+        self.assertEqual(
+            (self.product.stock, self.product.is_low_stock), (stock, is_low_stock)
+        )
+        call_command("rebuild_stock", check=True, stdout=StringIO())
+
+    def test_follows_batches_and_sales(self):
+        self.assertStock(10, False)
+        complete_sale = self.sell(6)
+        self.assertStock(4, True)
+
+        response = self.client.patch(
+            f"/api/products/{self.product.id}/", {"alert_quantity": 3}, format="json"
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertStock(4, False)
+
+        response = self.client.post(
+            "/api/batchs/",
+            {"product": self.product.id, "quantity": 2, "buy_price": 5},
+            format="json",
+        )
+        self.assertStock(6, False)
+        self.client.delete(f"/api/batchs/{response.data['id']}/")
+        self.assertStock(4, False)
+
+        open_batch = Batch.objects.get(quantity__gt=0)
+        self.client.patch(
+            f"/api/batchs/{open_batch.id}/", {"quantity": 1}, format="json"
+        )
+        self.assertStock(1, True)
+
+        self.client.post(
+            "/api/sales/revert_sale/", {"sale_id": complete_sale.id}, format="json"
+        )
+        self.assertStock(7, False)
+
+    def test_batch_moved_to_another_product(self):
+        other = Product.objects.create(
+            name="12ga", category=self.product.category, sale_price=5, alert_quantity=1
+        )
+        batch = Batch.objects.earliest("id")
+        self.client.patch(
+            f"/api/batchs/{batch.id}/", {"product": other.id}, format="json"
+        )
+
+        self.assertStock(5, False)
+        other.refresh_from_db()
+        self.assertEqual((other.stock, other.is_low_stock), (5, False))
+
+
+class AlertTests(SaleTestCase):
+    def receive_expiring(self, days: int) -> int:
+        response = self.client.post(
+            "/api/batchs/",
+            {
+                "product": self.product.id,
+                "quantity": 1,
+                "buy_price": 5,
+                "obsolete_date": date.today() + timedelta(days=days),
+            },
+            format="json",
+        )
+        return response.data["id"]
+
+    def alerts(self, query: str = "") -> dict:
+        response = self.client.get(f"/api/alerts/{query}")
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_low_stock_products(self):
+        self.assertEqual(self.alerts()["low_stock"], [])
+        self.sell(6)
+        self.assertEqual(
+            [product["id"] for product in self.alerts()["low_stock"]],
+            [self.product.id],
+        )
+
+    def test_expiring_batches(self):
+        later, soon = self.receive_expiring(40), self.receive_expiring(3)
+        emptied = self.receive_expiring(1)
+        self.client.patch(f"/api/batchs/{emptied}/", {"quantity": 0}, format="json")
+
+        self.assertEqual(
+            [batch["id"] for batch in self.alerts()["expiring_batches"]], [soon]
+        )
+        self.assertEqual(
+            [batch["id"] for batch in self.alerts("?days=60")["expiring_batches"]],
+            [soon, later],
+        )
+        self.assertEqual(self.client.get("/api/alerts/?days=abc").status_code, 400)
+
+
+class ComputedFieldsTests(SaleTestCase):
+    def test_prefilled_from_annotations(self):
+        self.sell(7)
+
+        sale_history = SaleHistory.objects.with_totals().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(sale_history.quantity_sold, 7)
+            self.assertEqual(sale_history.total_sold, 70)
+            self.assertEqual(sale_history.product_name, "9mm")
+
+        computed = SaleHistory.objects.get(pk=sale_history.pk)
+        self.assertEqual(computed.quantity_sold, sale_history.quantity_sold)
+        self.assertEqual(computed.total_cost, sale_history.total_cost)
+        self.assertEqual(computed.total_renevue, sale_history.total_renevue)
+
+    def test_cached_per_instance(self):
+        self.sell(3)
+        sale_history = SaleHistory.objects.get()
+        self.assertEqual(sale_history.quantity_sold, 3)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(sale_history.quantity_sold, 3)
+
+        BatchSale.objects.filter(sale_history=sale_history).update(quantity=2)
+        # Another instance of the same row must not see the first one's value.
+        self.assertEqual(SaleHistory.objects.get().quantity_sold, 2)
+
+        sale_history.refresh_from_db()
+        self.assertEqual(sale_history.quantity_sold, 2)
+
+    def test_no_stale_totals_after_revert_sale(self):
+        complete_sale = self.sell(7)
+        sale_history = complete_sale.sales.get()
+        self.assertEqual(sale_history.quantity_sold, 7)
+
+        response = self.client.post(
+            "/api/sales/revert_sale/", {"sale_id": complete_sale.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 204)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+        self.sell(2)
+        totals = {
+            sale.pk: sale.quantity_sold
+            for sale in SaleHistory.objects.with_totals().order_by("id")
+        }
+        self.assertEqual(list(totals.values()), [7, 2])
+        self.assertEqual(
+            SaleHistory.objects.latest("id").total_cost,
+            2 * float(Batch.objects.get(quantity=3).buy_price),
+        )
+
+    def test_instances_are_not_retained(self):
+        self.sell(1)
+        sale_history = SaleHistory.objects.get()
+        sale_history.quantity_sold
+        reference = weakref.ref(sale_history)
+
+        del sale_history
+        gc.collect()
+        self.assertIsNone(reference())
+
+
+class RevertSaleTests(SaleTestCase):
+    def revert(self, complete_sale: CompleteSale, lines=None):
+        data = {"sale_id": complete_sale.id}
+        if lines is not None:
+            data["lines"] = lines
+        return self.client.post("/api/sales/revert_sale/", data, format="json")
+
+    def test_partial_revert_returns_last_allocated_units_first(self):
+        complete_sale = self.sell(7)
+        sale_history = complete_sale.sales.get()
+
+        response = self.revert(
+            complete_sale, [{"sale_history": sale_history.id, "quantity": 3}]
+        )
+        self.assertEqual(response.status_code, 204)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 6)
+        self.assertEqual(
+            list(
+                Batch.objects.order_by("received_at").values_list("quantity", flat=True)
+            ),
+            [1, 5],
+        )
+        self.assertEqual(SaleHistory.objects.with_totals().get().quantity_sold, 4)
+        self.assertEqual(
+            list(BatchSale.objects.order_by("id").values_list("quantity", flat=True)),
+            [4, 0],
+        )
+        self.assertEqual(
+            sorted(
+                BatchSaleReturn.objects.values_list(
+                    "batch_sale__batch__buy_price", "quantity", "returned_on"
+                )
+            ),
+            [(4, 1, date.today()), (6, 2, date.today())],
+        )
+        complete_sale.refresh_from_db()
+        self.assertFalse(complete_sale.reverted)
+
+        response = self.revert(complete_sale, [{"sale_history": sale_history.id}])
+        self.assertEqual(response.status_code, 204)
+        complete_sale.refresh_from_db()
+        self.assertTrue(complete_sale.reverted)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+    def test_cannot_return_more_than_sold(self):
+        complete_sale = self.sell(2)
+        sale_history = complete_sale.sales.get()
+
+        response = self.revert(
+            complete_sale, [{"sale_history": sale_history.id, "quantity": 3}]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+    def test_malformed_returns_are_rejected(self):
+        complete_sale = self.sell(7)
+        sale_history = complete_sale.sales.get()
+
+        for lines in (
+            [{"sale_history": "abc"}],
+            [{"sale_history": None}],
+            [{"sale_history": sale_history.id, "quantity": "x"}],
+            [{"sale_history": sale_history.id, "quantity": 0}],
+            {"sale_history": sale_history.id},
+            ["1", "2"],
+            [],
+        ):
+            with self.subTest(lines=lines):
+                self.assertEqual(self.revert(complete_sale, lines).status_code, 400)
+        self.assertEqual(
+            self.client.post(
+                "/api/sales/revert_sale/", [complete_sale.id], format="json"
+            ).status_code,
+            400,
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_whole_revert_is_idempotent(self):
+        complete_sale = self.sell(7)
+
+        for _ in range(2):
+            self.assertEqual(self.revert(complete_sale).status_code, 204)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(
+            sum(Batch.objects.values_list("quantity", flat=True)), self.product.stock
+        )
+
+    def test_void_many_sales(self):
+        complete_sales = [self.sell(2), self.sell(3)]
+        self.revert(complete_sales[0])
+
+        response = self.client.post(
+            "/api/sales/void/",
+            {"sale_ids": [sale.id for sale in complete_sales] + [0]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["not_found", "already_reverted", "reverted"],
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(
+            sum(Batch.objects.values_list("quantity", flat=True)), self.product.stock
+        )
+
+    def test_void_by_filter(self):
+        self.sell(2)
+        self.sell(3)
+
+        response = self.client.post(
+            "/api/sales/void/", {"sold_by": self.user.id}, format="json"
+        )
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertFalse(CompleteSale.objects.filter(reverted=False).exists())
+        self.assertEqual(
+            self.client.post("/api/sales/void/", {}, format="json").status_code, 400
+        )
+
+    def test_rejects_bodies_that_select_nothing(self):
+        complete_sales = [self.sell(2), self.sell(3)]
+
+        for body in (
+            {"date_from": ""},
+            {"date_from": "", "sold_by": ""},
+            {"reverted": "false"},
+            {"date_from": "yesterday"},
+            {"sale_ids": "12"},
+            {"sale_ids": ["abc"]},
+            [complete_sales[0].id],
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(
+                    self.client.post(
+                        "/api/sales/void/", body, format="json"
+                    ).status_code,
+                    400,
+                )
+        self.assertFalse(CompleteSale.objects.filter(reverted=True).exists())
+
+
+class IdempotentSaleTests(SaleTestCase):
+    def submit(self, sale_uuid, quantity: int):
+        return self.client.post(
+            "/api/sales/sell/",
+            {
+                "uuid": str(sale_uuid),
+                "lines": [{"product": self.product.id, "quantity": quantity}],
+            },
+            format="json",
+        )
+
+    def test_resubmitted_sale_is_sold_once(self):
+        sale_uuid = uuid.uuid4()
+        first = self.submit(sale_uuid, 3)
+        retry = self.submit(sale_uuid, 3)
+
+        self.assertEqual(first.status_code, 200, first.data)
+        self.assertEqual(retry.status_code, 200, retry.data)
+        self.assertFalse(first.data["duplicate"])
+        self.assertTrue(retry.data["duplicate"])
+        self.assertEqual(retry.data["sale_id"], first.data["sale_id"])
+        self.assertEqual(CompleteSale.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+        self.assertEqual(self.submit("not-a-uuid", 1).status_code, 400)
+
+    def test_sell_batch_reports_every_sale(self):
+        sold, rejected = str(uuid.uuid4()), str(uuid.uuid4())
+        self.submit(sold, 2)
+        queue = [
+            {"uuid": sold, "lines": [{"product": self.product.id, "quantity": 2}]},
+            {"uuid": rejected, "lines": [{"product": self.product.id, "quantity": 50}]},
+            {"lines": [{"product": self.product.id, "quantity": 1}]},
+            {
+                "uuid": str(uuid.uuid4()),
+                "lines": [{"product": self.product.id, "quantity": 4}],
+            },
+        ]
+
+        response = self.client.post("/api/sales/sell_batch/", queue, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        results = response.data["results"]
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["duplicate", "rejected", "rejected", "sold"],
+        )
+        self.assertIn("uuid", results[2]["errors"])
+        self.assertEqual(CompleteSale.objects.count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+
+        with override_settings(SELL_BATCH_MAX_SALES=1):
+            response = self.client.post("/api/sales/sell_batch/", queue, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_sell_batch_rejects_malformed_sales_only(self):
+        def sale(**line):
+            return {"uuid": str(uuid.uuid4()), "lines": [line] if line else []}
+
+        queue = [
+            sale(product=self.product.id, quantity=1),
+            sale(product=self.product.id, quantity="two"),
+            sale(product="abc", quantity=1),
+            sale(),
+            sale(product=self.product.id, quantity=2),
+        ]
+        response = self.client.post("/api/sales/sell_batch/", queue, format="json")
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [result["status"] for result in response.data["results"]],
+            ["sold", "rejected", "rejected", "rejected", "sold"],
+        )
+        self.assertEqual(CompleteSale.objects.count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+
+class RollupTests(SaleTestCase):
+    def rollups(self):
+        return list(
+            DailySalesRollup.objects.filter(units__gt=0)
+            .order_by("date", "product", "seller")
+            .values("date", "product", "category", "seller", "units", "revenue", "cost")
+        )
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        returned = self.sell(7)
+        voided = self.sell(2)
+        self.sell(1)
+
+        sale_history = returned.sales.get()
+        self.client.post(
+            "/api/sales/revert_sale/",
+            {
+                "sale_id": returned.id,
+                "lines": [{"sale_history": sale_history.id, "quantity": 3}],
+            },
+            format="json",
+        )
+        response = self.client.post(
+            "/api/sales/void/", {"sale_ids": [voided.id]}, format="json"
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+
+        incremental = self.rollups()
+        self.assertEqual(incremental[0]["units"], 5)
+        self.assertEqual(incremental[0]["revenue"], 50)
+
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+
+
+class InventoryValuationTests(SaleTestCase):
+    def sell_on(self, quantity: int, days_ago: int) -> CompleteSale:
+        complete_sale = self.sell(quantity)
+        CompleteSale.objects.filter(pk=complete_sale.pk).update(
+            date_sold=date.today() - timedelta(days=days_ago)
+        )
+        return complete_sale
+
+    def test_rebuilds_the_stock_of_a_past_day(self):
+        Batch.objects.update(date_created=date.today() - timedelta(days=10))
+        returned = self.sell_on(3, days_ago=8)
+        self.sell_on(2, days_ago=8)
+        self.sell_on(4, days_ago=1)
+        self.client.post(
+            "/api/sales/revert_sale/", {"sale_id": returned.id}, format="json"
+        )
+        returned.refresh_from_db()
+        self.assertEqual(returned.reverted_on, date.today())
+        CompleteSale.objects.filter(pk=returned.pk).update(
+            reverted_on=date.today() - timedelta(days=2)
+        )
+        reverted_before = self.sell_on(1, days_ago=8)
+        self.client.post(
+            "/api/sales/revert_sale/", {"sale_id": reverted_before.id}, format="json"
+        )
+        CompleteSale.objects.filter(pk=reverted_before.pk).update(
+            reverted_on=date.today() - timedelta(days=7)
+        )
+
+        def quantity(as_of: date = None) -> int:
+            params = {"as_of": as_of.isoformat()} if as_of else {}
+            response = self.client.get("/api/reports/inventory/", params)
+            return response.data["totals"]["quantity"]
+
+        self.assertEqual(quantity(), 4)
+        # 10 received, 3 + 2 sold 8 days ago, the 3 only came back 2 days ago.
+        self.assertEqual(quantity(date.today() - timedelta(days=5)), 5)
+        self.assertEqual(quantity(date.today() - timedelta(days=9)), 10)
+        self.assertEqual(quantity(date.today() - timedelta(days=11)), 0)
+
+    def test_partial_returns_count_from_the_day_they_happen(self):
+        Batch.objects.update(date_created=date.today() - timedelta(days=10))
+        complete_sale = self.sell_on(7, days_ago=8)
+        self.client.post(
+            "/api/sales/revert_sale/",
+            {
+                "sale_id": complete_sale.id,
+                "lines": [
+                    {"sale_history": complete_sale.sales.get().id, "quantity": 3}
+                ],
+            },
+            format="json",
+        )
+        BatchSaleReturn.objects.update(returned_on=date.today() - timedelta(days=2))
+
+        def quantity(days_ago: int) -> int:
+            as_of = date.today() - timedelta(days=days_ago)
+            response = self.client.get(
+                "/api/reports/inventory/", {"as_of": as_of.isoformat()}
+            )
+            return response.data["totals"]["quantity"]
+
+        self.assertEqual(quantity(days_ago=5), 3)
+        self.assertEqual(quantity(days_ago=1), 6)
+        self.assertEqual(quantity(days_ago=9), 10)
+
+
+class CatalogCacheTests(SaleTestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+
+    def get(self, url: str, etag: str = None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(url, **headers)
+
+    def test_not_modified_until_stock_moves(self):
+        url = f"/api/products/{self.product.id}/"
+        etag = self.get(url)["ETag"]
+        self.get("/api/products/")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(url, etag).status_code, 304)
+            list_etag = self.get("/api/products/")["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sell(3)
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["quantity"], 7)
+        self.assertEqual(self.get("/api/products/", list_etag).status_code, 200)
+
+    def test_category_rename_invalidates_products(self):
+        url = f"/api/products/{self.product.id}/"
+        etag = self.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.update(name="Balas")
+            Category.objects.get().save()
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["category"], "Balas")
+
+
+class ExportTests(SaleTestCase):
+    def export(self, url: str):
+        """Returns the parsed CSV and the queries run while streaming it"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            content = b"".join(response.streaming_content).decode()
+        self.assertTrue(content.startswith("\ufeff"))
+        return list(csv.reader(StringIO(content[1:]))), len(queries)
+
+    def add_products(self, count: int):
+        first = Product.objects.count()
+        Product.objects.bulk_create(
+            Product(name=f"p{i}", category=self.product.category, sale_price=1)
+            for i in range(first, first + count)
+        )
+
+    def test_products(self):
+        rows, _ = self.export("/api/products/export/")
+        self.assertEqual(rows[0], PRODUCT_TABLE_HEADERS)
+        (row,) = rows[1:]
+        self.assertEqual(
+            row[:3] + row[4:6], [str(self.product.id), "9mm", "Munición", "5", "10"]
+        )
+        # Decimal places depend on the database.
+        self.assertEqual((Decimal(row[3]), Decimal(row[6])), (10, 100))
+
+        self.add_products(3)
+        rows, _ = self.export("/api/products/export/?name=9m")
+        self.assertEqual([row[1] for row in rows[1:]], ["9mm"])
+
+    def test_batches(self):
+        self.sell(5)
+        rows, _ = self.export("/api/batchs/export/")
+        self.assertEqual(rows[0], BATCH_TABLE_HEADERS_WITH_PRODUCT)
+        self.assertEqual(len(rows), 3)
+
+        rows, _ = self.export("/api/batchs/export/?is_open=true")
+        self.assertEqual([(row[1], row[3]) for row in rows[1:]], [("9mm", "5")])
+
+    def test_sales(self):
+        self.sell(3)
+        other = Product.objects.create(
+            name="12ga", category=self.product.category, sale_price=7
+        )
+        self.client.post(
+            "/api/batchs/",
+            {"product": other.id, "quantity": 5, "buy_price": 2},
+            format="json",
+        )
+        self.client.post(
+            "/api/sales/sell/", [{"product": other.id, "quantity": 2}], format="json"
+        )
+
+        rows, _ = self.export("/api/salehistory/export/")
+        self.assertEqual(rows[0], SALES_TABLE_HEADERS)
+        self.assertEqual(
+            [(row[1], row[5], row[6]) for row in rows[1:]],
+            [("12ga", "2", "14.0"), ("9mm", "3", "30.0")],
+        )
+
+        rows, _ = self.export(f"/api/salehistory/export/?product={other.id}")
+        self.assertEqual([row[1] for row in rows[1:]], ["12ga"])
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.add_products(2)
+        _, few = self.export("/api/products/export/")
+        self.add_products(50)
+        rows, many = self.export("/api/products/export/")
+        self.assertEqual(len(rows), 54)
+        self.assertEqual(few, many)
+
+
+class CatalogImportTests(SaleTestCase):
+    def upload(self, content: bytes):
+        return self.client.post(
+            "/api/products/import_csv/",
+            {"file": SimpleUploadedFile("catalog.csv", content)},
+            format="multipart",
+        )
+
+    def test_imports_valid_rows_and_reports_the_rest(self):
+        response = self.upload(
+            "nombre,categoría,precio unitario,cantidad de alerta\n"
+            "9mm,Munición,12.5,3\n"
+            "A1,Rifles,100,\n"
+            ",Rifles,1,\n"
+            "A2,Rifles,caro,-1\n"
+            "A1,Rifles,120,2\n".encode()
+        )
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data["rows"], 5)
+        self.assertEqual(response.data["imported"], 3)
+        self.assertEqual(set(response.data["errors"]), {4, 5})
+        self.assertEqual(
+            set(response.data["errors"][5]), {"sale_price", "alert_quantity"}
+        )
+        products = {p.name: p for p in Product.objects.select_related("category")}
+        self.assertEqual(set(products), {"9mm", "A1"})
+        self.assertEqual(products["9mm"].sale_price, Decimal("12.50"))
+        self.assertFalse(products["9mm"].is_low_stock)
+        self.assertEqual(products["A1"].sale_price, 120)
+        self.assertEqual(products["A1"].category.name, "Rifles")
+
+    def test_rejects_files_that_are_not_utf8(self):
+        response = self.upload(
+            "nombre,categoría,precio unitario\nMunición,ñ,1\n".encode("latin-1")
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.count(), 1)
+
+
+class FilterTests(SaleTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.other = Product.objects.create(
+            name="Z1", category=Category.objects.create(name="Armas"), sale_price=5
+        )
+        self.client.post(
+            "/api/batchs/",
+            {"product": self.other.id, "quantity": 5, "buy_price": 2},
+            format="json",
+        )
+
+    def results(self, url: str, key: str = "id") -> list:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row[key] for row in response.data["results"]]
+
+    def days_ago(self, days: int) -> date:
+        return date.today() - timedelta(days=days)
+
+    def test_products(self):
+        # Ordered by name alone, the unique key of the cursor, not by category.
+        self.assertEqual(self.results("/api/products/", "name"), ["9mm", "Z1"])
+        self.assertEqual(
+            self.results(f"/api/products/?category={self.other.category_id}"),
+            [self.other.id],
+        )
+        self.assertEqual(self.results("/api/products/?name=9M"), [self.product.id])
+
+        self.assertEqual(self.results("/api/products/?low_stock=true"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sell(6)
+        self.assertEqual(
+            self.results("/api/products/?low_stock=true"), [self.product.id]
+        )
+        self.assertEqual(
+            self.results("/api/products/?low_stock=false"), [self.other.id]
+        )
+
+    def test_batches(self):
+        old, new, other = Batch.objects.order_by("id")
+        Batch.objects.filter(pk=old.pk).update(date_created=self.days_ago(10))
+
+        self.assertEqual(
+            self.results(f"/api/batchs/?date_from={self.days_ago(5)}"),
+            [other.id, new.id],
+        )
+        self.assertEqual(
+            self.results(f"/api/batchs/?date_to={self.days_ago(5)}"), [old.id]
+        )
+        self.assertEqual(
+            self.results(f"/api/batchs/?category={self.other.category_id}"),
+            [other.id],
+        )
+        self.sell(5)
+        self.assertEqual(self.results("/api/batchs/?is_open=false"), [old.id])
+
+    def test_sales(self):
+        old = self.sell(2)
+        CompleteSale.objects.filter(pk=old.pk).update(date_sold=self.days_ago(10))
+        new = self.client.post(
+            "/api/sales/sell/",
+            [{"product": self.other.id, "quantity": 1}],
+            format="json",
+        ).data["sale_id"]
+
+        self.assertEqual(
+            self.results(f"/api/sales/?date_from={self.days_ago(5)}"), [new]
+        )
+        self.assertEqual(
+            self.results(f"/api/sales/?date_to={self.days_ago(5)}"), [old.id]
+        )
+        self.assertEqual(
+            self.results(f"/api/sales/?product={self.product.id}"), [old.id]
+        )
+        self.assertEqual(
+            self.results(f"/api/sales/?category={self.other.category_id}"), [new]
+        )
+        self.assertEqual(
+            self.results(
+                f"/api/salehistory/?date_to={self.days_ago(5)}", "product_name"
+            ),
+            ["9mm"],
+        )
+        self.assertEqual(
+            self.results(
+                f"/api/salehistory/?category={self.other.category_id}", "product_name"
+            ),
+            ["Z1"],
+        )
+
+    def test_invalid_values_are_rejected(self):
+        for url in (
+            "/api/products/?category=abc",
+            "/api/products/?category=999",
+            "/api/batchs/?date_from=yesterday",
+            "/api/batchs/?product=abc",
+            "/api/sales/?date_to=2024-13-01",
+            "/api/sales/?sold_by=999",
+            "/api/salehistory/?product=abc",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class ProductPaginationTests(SaleTestCase):
+    def test_pages_are_keyset_seeks(self):
+        cache.clear()
+        for i in range(6):
+            Product.objects.create(
+                name=f"{i} 9mm", category=self.product.category, sale_price=1
+            )
+
+        names = []
+        url = f"/api/products/?category={self.product.category.id}&page_size=2"
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                names += [product["name"] for product in response.data["results"]]
+                url = response.data["next"]
+
+        self.assertEqual(names, sorted(Product.objects.values_list("name", flat=True)))
+        self.assertFalse(
+            [query["sql"] for query in queries if "OFFSET" in query["sql"]]
+        )
+
+
+@override_settings(PRODUCT_SYNC_SETTLE_SECONDS=0)
+class ProductSyncTests(SaleTestCase):
+    def sync(self, token: str = None):
+        response = self.client.get(
+            "/api/products/changes/", {"token": token} if token else {}
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_only_changed_products_are_sent(self):
+        other = Product.objects.create(
+            name="12ga", category=self.product.category, sale_price=20
+        )
+        full = self.sync()
+        self.assertTrue(full["full"])
+        self.assertEqual(len(full["products"]), 2)
+
+        self.assertEqual(self.sync(full["token"])["products"], [])
+
+        self.sell(3)
+        other_id = other.id
+        other.delete()
+        delta = self.sync(full["token"])
+        self.assertFalse(delta["full"])
+        self.assertEqual(
+            [(p["id"], p["quantity"]) for p in delta["products"]],
+            [(self.product.id, 7)],
+        )
+        self.assertEqual(delta["deleted"], [other_id])
+        self.assertEqual(self.sync(delta["token"])["products"], [])
+
+    def test_tokens_older_than_the_pruned_log_get_the_catalog(self):
+        old = self.sync()["token"]
+        self.sell(3)
+        self.sell(1)
+        latest = self.sync(old)["token"]
+
+        call_command("prune_product_changes", days=0, stdout=StringIO())
+        self.assertEqual(ProductChange.objects.count(), 1)
+        self.assertTrue(self.sync(old)["full"])
+        self.assertFalse(self.sync(latest)["full"])
+
+        ProductChange.objects.all().delete()
+        resync = self.sync(latest)
+        self.assertTrue(resync["full"])
+        self.assertEqual([p["id"] for p in resync["products"]], [self.product.id])
+
+
+class EventStreamTests(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name="Munición")
+        self.product = Product.objects.create(
+            name="9mm", category=category, sale_price=10, alert_quantity=5
+        )
+        self.client.post(
+            "/api/batchs/",
+            {"product": self.product.id, "quantity": 5, "buy_price": 4},
+            format="json",
+        )
+        _, self.token = AuthToken.objects.create(self.user)
+
+    def sell(self):
+        self.client.post(
+            "/api/sales/sell/",
+            [{"product": self.product.id, "quantity": 2}],
+            format="json",
+        )
+
+    async def open_stream(self, query: str):
+        sent, received = asyncio.Queue(), asyncio.Queue()
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": EVENTS_PATH,
+            "query_string": query.encode(),
+            "headers": [],
+        }
+        task = asyncio.ensure_future(event_stream(scope, received.get, sent.put))
+        await received.put({"type": "http.request", "body": b"", "more_body": False})
+        return task, sent, received
+
+    async def test_streams_stock_events(self):
+        task, sent, received = await self.open_stream(
+            f"token={self.token}&events=stock"
+        )
+        self.assertEqual((await sent.get())["status"], 200)
+        self.assertEqual((await sent.get())["body"], b": connected\n\n")
+
+        await sync_to_async(self.sell)()
+        event, data = (
+            (await asyncio.wait_for(sent.get(), 5))["body"]
+            .decode()
+            .strip()
+            .splitlines()
+        )
+        self.assertEqual(event, "event: stock")
+        self.assertEqual(
+            json.loads(data.removeprefix("data: "))["products"],
+            [{"id": self.product.id, "stock": 3, "is_low_stock": True}],
+        )
+
+        await received.put({"type": "http.disconnect"})
+        await task
+        self.assertFalse(broker.subscribers)
+
+    async def test_rejects_invalid_tokens(self):
+        task, sent, _ = await self.open_stream("token=invalid")
+        await task
+        self.assertEqual((await sent.get())["status"], 401)
+
+
+class QueryCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_data",
+            categories=3,
+            products=30,
+            batches=300,
+            sales=60,
+            stdout=StringIO(),
+        )
+
+    def setUp(self):
+        self.client = authenticated_client()
+
+    def test_page_size_does_not_add_queries(self):
+        self.assertEqual(
+            query_growth(self.client, small=1, large=20),
+            {"products": 0, "batches": 0, "sale history": 0, "sales": 0},
+        )
+
+    def test_only_catalog_responses_are_invalidated(self):
+        cache.set("unrelated", "kept")
+        query_growth(self.client, small=1, large=2)
+        self.assertEqual(cache.get("unrelated"), "kept")
+
+    def test_checkout_queries_do_not_grow_with_lines(self):
+        one_line, ten_lines = (
+            measure_checkout(self.client, lines, repeat=2) for lines in (1, 10)
+        )
+        for single, many in zip(one_line, ten_lines):
+            self.assertEqual(single.queries, many.queries, many.name)
+
+    def test_bench_api_writes_json(self):
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "bench_api", repeat=2, lines=3, output=output.name, stdout=StringIO()
+            )
+            results = json.load(output)
+
+        self.assertEqual(set(results["query_growth"].values()), {0})
+        self.assertIn("sell (3 lines)", [r["name"] for r in results["results"]])
+
+
+class InstrumentationTests(SaleTestCase):
+    def test_server_timing_and_metrics(self):
+        self.sell(1)
+        response = self.client.get("/api/products/")
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"',
+        )
+
+        metrics = self.client.get("/api/metrics/").content.decode()
+        self.assertIn(
+            'http_request_queries_count{view="products-list",method="GET",status="200"}',
+            metrics,
+        )
+        self.assertIn('http_request_duration_seconds_bucket{view="sales-sell"', metrics)
+
+        self.client.force_authenticate(User.objects.create_user("cashier"))
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+
+
+class AsyncViewTests(SaleTestCase):
+    def setUp(self):
+        super().setUp()
+        _, token = AuthToken.objects.create(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        self.complete_sale = self.sell(7)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_same_data_as_the_sync_views(self):
+        self.assertEqual(
+            self.get("/api/async/products/")["results"],
+            self.get("/api/products/")["results"],
+        )
+        self.assertEqual(
+            self.get(f"/api/async/products/{self.product.id}/"),
+            self.get(f"/api/products/{self.product.id}/"),
+        )
+        self.assertEqual(
+            self.get("/api/async/sales/")["results"],
+            self.get("/api/sales/")["results"],
+        )
+        for url, params in (
+            ("reports/sales/", {"group_by": "product,seller"}),
+            ("reports/inventory/", {"group_by": "category"}),
+        ):
+            self.assertEqual(
+                self.get(f"/api/async/{url}", **params),
+                self.get(f"/api/{url}", **params),
+            )
+
+    def test_pagination_and_filters(self):
+        category = self.product.category
+        for name in ("a", "b"):
+            Product.objects.create(name=name, category=category, sale_price=1)
+        self.sell(1)
+
+        first = self.get("/api/async/products/", page_size=2)
+        self.assertEqual(first["count"], 3)
+        second = self.get("/api/async/products/", page_size=2, after=first["next"])
+        self.assertIsNone(second["next"])
+        self.assertEqual(
+            [p["id"] for p in first["results"] + second["results"]],
+            sorted(Product.objects.values_list("id", flat=True)),
+        )
+        self.assertEqual(self.get("/api/async/products/", low_stock=True)["count"], 1)
+
+        sales = self.get("/api/async/sales/", page_size=1)
+        self.assertEqual(len(sales["results"]), 1)
+        self.assertEqual(
+            self.get("/api/async/sales/", before=sales["next"])["results"][0]["id"],
+            self.complete_sale.id,
+        )
+        self.assertEqual(
+            self.client.get("/api/async/products/", {"category": 999}).status_code,
+            400,
+        )
+
+    def test_summary_report(self):
+        summary = self.get("/api/async/reports/summary/")
+        self.assertEqual(summary["sales"]["units"], 7)
+        self.assertEqual(summary["sales"]["sales"], 1)
+        self.assertEqual(summary["stock"]["units"], 3)
+        self.assertEqual(summary["low_stock_products"], 1)
+
+        response = self.client.get("/api/async/reports/summary/")
+        self.assertRegex(
+            response["Server-Timing"], r'db;dur=[\d.]+;desc="[1-9]\d* queries"'
+        )
+
+    def test_authentication(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get("/api/async/products/").status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION="Token nope")
+        self.assertEqual(self.client.get("/api/async/sales/").status_code, 401)
+
+
+class TokenCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("cashier", password="pw")
+        _, token = AuthToken.objects.create(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+
+    def test_verified_tokens_skip_the_database(self):
+        self.assertEqual(self.client.get("/api/alerts/").status_code, 200)
+        request = Request(self.client.get("/api/alerts/").wsgi_request)
+        with self.assertNumQueries(0):
+            user, _ = CachedTokenAuthentication().authenticate(request)
+        self.assertEqual(user, self.user)
+
+    def test_logout_invalidates_the_token(self):
+        self.client.get("/api/alerts/")
+        self.assertEqual(self.client.post("/api/logout/").status_code, 204)
+        self.assertEqual(self.client.get("/api/alerts/").status_code, 401)
+
+    def test_deactivation_invalidates_the_token(self):
+        self.client.get("/api/alerts/")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/alerts/").status_code, 401)
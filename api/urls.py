@@ -2,6 +2,7 @@ from django.urls import include, path
 from knox.views import LogoutView
 from rest_framework import routers
 
+from api import async_views
 from api.views import (
     BatchView,
     CategoryView,
@@ -9,7 +10,11 @@ from api.views import (
     LoginView,
     ProductView,
     SaleHistoryView,
+    alerts,
+    inventory_valuation_report,
+    prometheus_metrics,
     register,
+    sales_report,
 )
 
 router = routers.DefaultRouter()
@@ -23,4 +28,35 @@ urlpatterns = [
     path(r"login/", LoginView.as_view(), name="knox_login"),
     path(r"logout/", LogoutView.as_view(), name="knox_logout"),
     path(r"register/", register),
+    path(r"alerts/", alerts, name="alerts"),
+    path(r"metrics/", prometheus_metrics, name="metrics"),
+    path(r"reports/sales/", sales_report, name="sales_report"),
+    path(
+        r"reports/inventory/",
+        inventory_valuation_report,
+        name="inventory_valuation_report",
+    ),
+    # Async read paths, native coroutines under the ASGI application.
+    path(r"async/products/", async_views.products, name="async_products"),
+    path(
+        r"async/products/<int:pk>/",
+        async_views.product_detail,
+        name="async_product_detail",
+    ),
+    path(r"async/sales/", async_views.sales, name="async_sales"),
+    path(
+        r"async/reports/sales/",
+        async_views.sales_report,
+        name="async_sales_report",
+    ),
+    path(
+        r"async/reports/inventory/",
+        async_views.inventory_valuation_report,
+        name="async_inventory_valuation_report",
+    ),
+    path(
+        r"async/reports/summary/",
+        async_views.summary_report,
+        name="async_summary_report",
+    ),
 ]
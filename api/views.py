@@ -1,27 +1,67 @@
-from typing import List
+import io
+from datetime import date, timedelta
 
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from django.db.models import ProtectedError
+from django.db import transaction
+from django.db.models import Prefetch, ProtectedError
+from django.http import HttpResponse
 from knox.views import LoginView as KnoxLoginView
 from rest_framework import mixins, status
 from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import BasePermission
+from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from api.models import Batch, BatchSale, Category, CompleteSale, Product, SaleHistory
+from api.cache import (
+    CATEGORIES_VERSION,
+    PRODUCTS_VERSION,
+    CachedResponseMixin,
+    product_version,
+)
+from api.catalog import import_catalog
+from api.exports import export_batches, export_products, export_sales
+from api.filters import (
+    BatchFilter,
+    CompleteSaleFilter,
+    ProductFilter,
+    SaleHistoryFilter,
+)
+from api.instrumentation import metrics
+from api.models import Batch, Category, CompleteSale, Product, SaleHistory
+from api.pagination import IdCursorPagination, ProductCursorPagination
+from api.reports import (
+    ReportError,
+    sales_report_rows,
+    valuation_params,
+    valuation_totals,
+)
+from api.sales import (
+    SaleError,
+    parse_sale_uuid,
+    revert_complete_sale,
+    sell_cart,
+    submit_sales,
+    void_sales,
+)
 from api.serializers import (
+    BatchReceiveSerializer,
     BatchSerializer,
     CategorySerializer,
     CompleteSaleSerializer,
     ProductSerializer,
     SaleHistorySerializer,
     UserSerializer,
+    VoidSalesSerializer,
 )
+from api.stock import inventory_valuation, receive_batches, sync_product_stock
+from api.sync import changes_since
 from api.utils import ResponseBadRequest, key_error_as_response_bad_request
 
 
@@ -84,9 +124,145 @@ def register(request):
     )
 
 
+@api_view(["GET"])
+def sales_report(request):
+    """Units, revenue, cost and margin per period, served from the daily rollups
+
+    ``group_by`` takes a comma separated list of product, category and seller.
+    """
+    try:
+        rows = sales_report_rows(request.query_params)
+    except ReportError as e:
+        return ResponseBadRequest(e.errors)
+
+    return Response(list(rows))
+
+
+@api_view(["GET"])
+def inventory_valuation_report(request):
+    """Stock value at cost and at sale price per product or category, optionally
+    as it was at the end of the ``as_of`` day"""
+    try:
+        group_by, as_of = valuation_params(request.query_params)
+    except ReportError as e:
+        return ResponseBadRequest(e.errors)
+
+    rows = list(inventory_valuation(group_by, as_of))
+    return Response({"as_of": as_of, "totals": valuation_totals(rows), "results": rows})
+
+
+@api_view(["GET"])
+def alerts(request):
+    """Low stock products and open batches becoming obsolete within ``days``
+
+    Both lists are read from partial indexes that only hold the flagged rows.
+    """
+    try:
+        days = int(request.query_params.get("days", settings.ALERT_EXPIRY_DAYS))
+    except ValueError:
+        return ResponseBadRequest({"days": "Debe ser un número entero"})
+
+    low_stock = (
+        Product.objects.filter(is_low_stock=True)
+        .select_related("category")
+        .order_by("category", "name")
+    )
+    expiring_batches = (
+        Batch.objects.filter(
+            quantity__gt=0,
+            obsolete_date__isnull=False,
+            obsolete_date__lte=date.today() + timedelta(days=days),
+        )
+        .select_related("product")
+        .order_by("obsolete_date", "id")
+    )
+    return Response(
+        {
+            "low_stock": ProductSerializer(low_stock, many=True).data,
+            "expiring_batches": BatchSerializer(expiring_batches, many=True).data,
+        }
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsSuperUser])
+def prometheus_metrics(request):
+    """Request histograms per view of this process in the Prometheus text format"""
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 class BatchView(ModelViewSet):
-    queryset = Batch.objects.all().prefetch_related("product")
+    queryset = Batch.objects.all().select_related("product")
     serializer_class = BatchSerializer
+    filterset_class = BatchFilter
+    pagination_class = IdCursorPagination
+
+    @action(detail=False, methods=["post"])
+    def bulk_receive(self, request):
+        """Receives a whole purchase order, errors come back per line like many=True"""
+        serializer = BatchReceiveSerializer(data=request.data, many=True)
+        if not isinstance(request.data, list):
+            serializer.is_valid(raise_exception=True)
+
+        serializer.is_valid()
+        field_errors = serializer.errors
+        # Newer DRF releases key the errors by line index instead of listing them.
+        if isinstance(field_errors, list):
+            field_errors = dict(enumerate(field_errors))
+        errors = [
+            dict(field_errors.get(index, {})) for index in range(len(request.data))
+        ]
+        # Products are looked up for every line, also those with field errors, so
+        # the whole order is reported at once.
+        product_ids = {}
+        for index, line in enumerate(request.data):
+            try:
+                product_ids[index] = int(line["product"])
+            except (KeyError, TypeError, ValueError):
+                continue
+        products = Product.objects.in_bulk(set(product_ids.values()))
+        for index, product_id in product_ids.items():
+            if product_id not in products and "product" not in errors[index]:
+                errors[index]["product"] = [
+                    PrimaryKeyRelatedField.default_error_messages[
+                        "does_not_exist"
+                    ].format(pk_value=product_id)
+                ]
+
+        if any(errors):
+            return ResponseBadRequest(errors)
+
+        lines = serializer.validated_data
+        for line in lines:
+            line["product"] = products[line["product"]]
+
+        batches = receive_batches(lines, request.user)
+        return Response(
+            BatchSerializer(batches, many=True).data, status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        return export_batches(self.filter_queryset(self.get_queryset()))
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        batch: Batch = serializer.save()
+        sync_product_stock([batch.product_id])
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_product_id = serializer.instance.product_id
+        batch: Batch = serializer.save()
+        sync_product_stock([previous_product_id, batch.product_id])
+
+    @transaction.atomic
+    def perform_destroy(self, instance: Batch):
+        product_id = instance.product_id
+        super().perform_destroy(instance)
+        sync_product_stock([product_id])
 
     def destroy(self, request, *args, **kwargs):
         try:
@@ -97,16 +273,72 @@ class BatchView(ModelViewSet):
             )
 
 
-class ProductView(ModelViewSet):
-    queryset = Product.objects.prefetch_related("category").order_by(
-        "category__name", "name"
-    )
+class ProductView(CachedResponseMixin, ModelViewSet):
+    queryset = Product.objects.select_related("category").order_by("name")
     serializer_class = ProductSerializer
+    filterset_class = ProductFilter
+    pagination_class = ProductCursorPagination
+    list_cache_versions = [PRODUCTS_VERSION]
+
+    def get_detail_cache_versions(self):
+        # Category versions are bumped by renames and bulk imports of the catalog.
+        return [product_version(self.kwargs["pk"]), CATEGORIES_VERSION]
 
     @permission_classes([IsSuperUser])
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """Delta sync, products changed since the ``token`` of the previous response,
+        the whole catalog without one"""
+        token = request.query_params.get("token")
+        try:
+            token = int(token) if token else None
+        except ValueError:
+            return ResponseBadRequest({"token": "Token de sincronización inválido"})
+
+        changes = changes_since(token)
+        return Response(
+            {
+                "token": str(changes.token),
+                "full": changes.full,
+                "more": changes.more,
+                "products": self.get_serializer(changes.products, many=True).data,
+                "deleted": changes.deleted,
+            }
+        )
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        return export_products(self.filter_queryset(self.get_queryset()))
+
+    @action(
+        detail=False,
+        methods=["post"],
+        permission_classes=[IsSuperUser],
+        parser_classes=[MultiPartParser],
+    )
+    def import_csv(self, request):
+        """Upserts categories and products by name from an uploaded CSV ``file``"""
+        upload = request.FILES.get("file")
+        if upload is None:
+            return ResponseBadRequest({"file": "Este campo es requerido"})
+
+        try:
+            # All or nothing, a decoding error may come after some chunks.
+            with transaction.atomic():
+                result = import_catalog(
+                    io.TextIOWrapper(upload.file, encoding="utf-8-sig")
+                )
+        except UnicodeDecodeError:
+            return ResponseBadRequest(
+                {"file": "El archivo debe estar codificado en UTF-8"}
+            )
+        return Response(
+            {"rows": result.rows, "imported": result.imported, "errors": result.errors}
+        )
+
     @permission_classes([IsSuperUser])
     def destroy(self, request, *args, **kwargs):
         try:
@@ -119,134 +351,141 @@ class ProductView(ModelViewSet):
             )
 
 
-class CategoryView(ModelViewSet):
+class CategoryView(CachedResponseMixin, ModelViewSet):
     permission_classes = [IsSuperUser]
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    list_cache_versions = [CATEGORIES_VERSION]
 
 
 class SaleHistoryView(mixins.ListModelMixin, GenericViewSet):
-    queryset = SaleHistory.objects.all()
+    queryset = SaleHistory.objects.with_totals().order_by("-id")
     serializer_class = SaleHistorySerializer
+    filterset_class = SaleHistoryFilter
+    pagination_class = IdCursorPagination
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        return export_sales(self.filter_queryset(self.get_queryset()))
 
 
 class CompleteSaleView(ModelViewSet):
-    queryset = CompleteSale.objects.prefetch_related(
-        "sales",
-        "sales__batch_sales",
-        "sales__batch_sales__batch",
-        "sales__batch_sales__batch__product",
-        "sales__batch_sales__batch__product__category",
-    ).order_by("-id")
+    queryset = (
+        CompleteSale.objects.select_related("sold_by")
+        .prefetch_related(
+            Prefetch("sales", queryset=SaleHistory.objects.with_totals().order_by("id"))
+        )
+        .order_by("-id")
+    )
     serializer_class = CompleteSaleSerializer
+    filterset_class = CompleteSaleFilter
+    pagination_class = IdCursorPagination
 
     @action(detail=False, methods=["post"])
     @key_error_as_response_bad_request
     def sell(self, request):
+        """Sells a cart, either the list of lines or ``{"uuid": ..., "lines": [...]}``
+        where the uuid, generated by the terminal, makes resubmitting it safe"""
         data = request.data
+        sale_uuid = None
 
-        print(data)
+        if isinstance(data, dict) and "lines" in data:
+            sale_uuid, data = data.get("uuid"), data["lines"]
         if not isinstance(data, list):
             data = [data]
 
-        complete_sale_instance = CompleteSale.objects.create(sold_by=request.user)
-
-        for index, product_dict in enumerate(data):
-            product_id: str = product_dict.pop("product")
-
-            try:
-                product_instance: Product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                return ResponseBadRequest(
-                    {index: {"product": "Este campo es requerido"}}
-                )
-
-            quantity = int(product_dict.pop("quantity"))
-
-            if quantity <= 0:
-                return ResponseBadRequest(
-                    {index: {"quantity": "No puedes vender una cantidad negativa"}}
-                )
+        try:
+            checkout = sell_cart(data, request.user, parse_sale_uuid(sale_uuid))
+        except SaleError as e:
+            return ResponseBadRequest(e.errors)
+
+        return Response(
+            {
+                "success": "La venta se ha efectuado satisfactoriamente",
+                "sale_id": checkout.complete_sale.id,
+                "duplicate": checkout.duplicate,
+            },
+            headers={"Server-Timing": f"lock;dur={checkout.lock_wait * 1000:.1f}"},
+        )
 
-            if product_instance.quantity < quantity:
-                return ResponseBadRequest(
-                    {index: {"quantity": "No hay suficiente cantidad en el inventario"}}
-                )
+    @action(detail=False, methods=["post"])
+    def sell_batch(self, request):
+        """Sells the sales buffered by an offline terminal, a list of
+        ``{"uuid": ..., "lines": [...]}``, in order and each in its own transaction.
+        Returns the outcome of every sale, a rejected sale does not stop the rest"""
+        queue = request.data
 
-            sale_history_instance = SaleHistory.objects.create(
-                unit_price=product_instance.sale_price,
-                complete_sale=complete_sale_instance,
+        if not isinstance(queue, list):
+            return ResponseBadRequest(
+                {"non_field_errors": "Se esperaba una lista de ventas"}
+            )
+        if len(queue) > settings.SELL_BATCH_MAX_SALES:
+            return ResponseBadRequest(
+                {
+                    "non_field_errors": "No se pueden enviar más de "
+                    f"{settings.SELL_BATCH_MAX_SALES} ventas a la vez"
+                }
             )
-            batch_sales_instances: List[BatchSale] = []
-
-            try:
-                batch_queryset: List[Batch] = product_instance.batch_set.filter(
-                    quantity__gt=0
-                )
-                for batch in batch_queryset:
-                    sell_quantity = min(batch.quantity, quantity)
-                    quantity -= sell_quantity
-                    batch.quantity -= sell_quantity
-                    batch_sales_instances.append(
-                        BatchSale(
-                            batch=batch,
-                            quantity=sell_quantity,
-                            sale_history=sale_history_instance,
-                        )
-                    )
-
-                    if quantity == 0:
-                        break
-
-                Batch.objects.bulk_update(batch_queryset, ["quantity"])
-                BatchSale.objects.bulk_create(batch_sales_instances)
-            except Exception as e:
-                complete_sale_instance.delete()
-                return ResponseBadRequest({index: e})
-
-        return Response({"success": "La venta se ha efectuado satisfactoriamente"})
-
-    def revert_batch_sale(self, complete_sale: CompleteSale):
-        batches_to_update: List[Batch] = []
-        if complete_sale.reverted is True:
-            return
-        for sale_history in complete_sale.sales.all():
-            print(sale_history)
-            for batch_sale in sale_history.batch_sales.all():
-                batch: Batch = batch_sale.batch
-                matching_batch = list(
-                    filter(lambda b: b.id == batch.id, batches_to_update)
-                )
-
-                if matching_batch:
-                    batch = matching_batch[0]
-                    batch.quantity += batch_sale.quantity
-                    continue
-
-                batch.quantity += batch_sale.quantity
-                batches_to_update.append(batch)
 
-        complete_sale.reverted = True
-        print(batches_to_update)
-        Batch.objects.bulk_update(batches_to_update, ["quantity"])
-        complete_sale.save()
+        return Response({"results": submit_sales(queue, request.user)})
 
     @action(detail=False, methods=["post"])
     @key_error_as_response_bad_request
     def revert_sale(self, request):
-        complete_sale_id = request.data.pop("sale_id")
-
-        complete_sale = CompleteSale.objects.prefetch_related(
-            "sales", "sales__batch_sales", "sales__batch_sales__batch"
-        ).get(pk=complete_sale_id)
-
+        """Reverts a whole sale, or only the ``lines`` given as
+        ``[{"sale_history": id, "quantity": units}]``, without quantity returns the
+        whole line"""
+        if not isinstance(request.data, dict):
+            return ResponseBadRequest(
+                {"non_field_errors": "Se esperaba un objeto con la venta"}
+            )
         try:
-            self.revert_batch_sale(complete_sale)
-        except Exception as e:
-            return ResponseBadRequest({"non_field_errors": e})
+            revert_complete_sale(request.data["sale_id"], request.data.get("lines"))
+        except SaleError as e:
+            return ResponseBadRequest(e.errors)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=["post"], permission_classes=[IsSuperUser])
+    def void(self, request):
+        """Reverts every sale of ``sale_ids``, or every sale matching the
+        CompleteSaleFilter fields given in the body, e.g. a date range and seller"""
+        if not isinstance(request.data, dict):
+            return ResponseBadRequest(
+                {"non_field_errors": "Se esperaba un objeto con las ventas o filtros"}
+            )
+        serializer = VoidSalesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sale_ids = serializer.validated_data.get("sale_ids")
+
+        if sale_ids is None:
+            filterset = CompleteSaleFilter(
+                request.data, queryset=CompleteSale.objects.filter(reverted=False)
+            )
+            if not filterset.is_valid():
+                return ResponseBadRequest(filterset.errors)
+            # Only unreverted sales are voided, ``reverted`` alone narrows nothing.
+            if not any(
+                value not in (None, "")
+                for name, value in filterset.form.cleaned_data.items()
+                if name != "reverted"
+            ):
+                return ResponseBadRequest(
+                    {"non_field_errors": "Indica las ventas o al menos un filtro"}
+                )
+            sale_ids = filterset.qs.values_list("id", flat=True)
+
+        results = void_sales(sale_ids)
+        return Response(
+            {
+                "results": [
+                    {"sale_id": sale_id, "status": result}
+                    for sale_id, result in results.items()
+                ]
+            }
+        )
+
+    @transaction.atomic
     def perform_destroy(self, instance):
-        self.revert_batch_sale(instance)
+        revert_complete_sale(instance.pk)
         super().perform_destroy(instance)
@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bullet_sales_system.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are loaded.
+from api.events import EVENTS_PATH, event_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Server-sent events are served outside of Django, so idle streams don't hold
+    # a request thread each.
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        await event_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
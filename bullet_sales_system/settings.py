@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.instrumentation.InstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -88,6 +90,27 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The per-process memory cache is only good for development and tests, point
+# production at a Redis server (needs the redis package) so every worker sees the
+# same invalidations.
+
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -132,8 +155,78 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "knox.auth.TokenAuthentication",
+        "api.auth.CachedTokenAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
 }
+
+
+# Authentication
+# Verified knox tokens and their users are cached this many seconds at most by
+# api.auth, logout and user changes invalidate them right away.
+
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+
+
+# Checkout
+# Order in which the batches of a product are sold: "fifo" (first received),
+# "fefo" (first to become obsolete) or "lifo" (last received).
+
+BATCH_ALLOCATION_STRATEGY = "fifo"
+
+# "lock" locks the open batches of the cart (SELECT ... FOR UPDATE) before allocating,
+# "optimistic" decrements them with guarded UPDATEs and no up-front locks.
+
+CHECKOUT_STOCK_MODE = "lock"
+
+# Retries of a sale that hit a serialization failure or a deadlock, the backoff
+# doubles on every attempt starting from CHECKOUT_RETRY_BACKOFF seconds.
+
+CHECKOUT_MAX_RETRIES = 3
+
+CHECKOUT_RETRY_BACKOFF = 0.05
+
+# Most sales a terminal can flush at once to /api/sales/sell_batch/.
+
+SELL_BATCH_MAX_SALES = 500
+
+
+# Alerts
+# Open batches becoming obsolete within this many days are listed by /api/alerts/.
+
+ALERT_EXPIRY_DAYS = 30
+
+
+# Catalog cache
+# Seconds a cached product or category response is kept, writes invalidate them
+# earlier through api.cache.
+
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+
+# Delta sync
+# Changes younger than PRODUCT_SYNC_SETTLE_SECONDS are sent again on the next sync,
+# so terminals do not skip changes of transactions committing out of order. At most
+# PRODUCT_SYNC_PAGE_SIZE products are sent per response.
+
+PRODUCT_SYNC_SETTLE_SECONDS = 5
+
+PRODUCT_SYNC_PAGE_SIZE = 500
+
+
+# Events
+# /api/events/ streams stock and sale events when served by the ASGI application. A
+# comment is sent on idle streams every EVENTS_HEARTBEAT_SECONDS, clients with more
+# than EVENTS_QUEUE_SIZE undelivered events are disconnected.
+
+EVENTS_HEARTBEAT_SECONDS = 15
+
+EVENTS_QUEUE_SIZE = 100
+
+
+# Instrumentation
+# Requests slower than this many seconds are logged as warnings by
+# api.instrumentation, per-view histograms are served at /api/metrics/.
+
+SLOW_REQUEST_SECONDS = 1.0